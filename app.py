@@ -8,9 +8,21 @@ from flask import Flask, render_template, redirect, url_for, session, jsonify
 from flask_session import Session
 from extensions import db
 from config import Config
-from routes import auth_bp, inventory_bp, billing_bp, main_bp
+from routes import auth_bp, inventory_bp, billing_bp, main_bp, reports_bp, metrics_bp, debug_bp, stream_bp
 from models import User
 from utils import hash_password, get_user_permissions
+from stats import rebuild_dashboard_stats
+from rollups import rebuild_sales_rollups
+from invoice_export import iter_invoice_zip
+from sessions import init_session_store, sweep_expired_sessions
+from signals import low_stock, log_low_stock
+from migrations import upgrade_database, migration_status
+from engine_profiles import configure_engine, install_sqlite_pragmas, sqlite_pragmas
+from metrics import init_metrics, clear_metrics_files, metrics_dir
+from query_profiler import init_query_profiler
+from idempotency import sweep_idempotency_keys
+from stock_events import sweep_stock_events
+import click
 import os
 
 def create_app(config_class=Config):
@@ -21,14 +33,36 @@ def create_app(config_class=Config):
     app.config.from_object(config_class)
 
     # Initialize Extensions
+    engine_profile = configure_engine(app)
     db.init_app(app)
-    Session(app)
+    if engine_profile == 'sqlite':
+        with app.app_context():
+            install_sqlite_pragmas(db.engine, sqlite_pragmas(app.config))
+    if app.config['SESSION_TYPE'] == 'database':
+        init_session_store(app)
+    else:
+        Session(app)
 
     # Register Blueprints
     app.register_blueprint(auth_bp)
     app.register_blueprint(inventory_bp)
     app.register_blueprint(billing_bp)
     app.register_blueprint(main_bp)
+    app.register_blueprint(reports_bp)
+    app.register_blueprint(stream_bp)
+
+    # Request / SQL instrumentation
+    if app.config['METRICS_ENABLED']:
+        with app.app_context():
+            init_metrics(app, db.engine)
+        app.register_blueprint(metrics_bp)
+    if app.config['SQL_PROFILING']:
+        with app.app_context():
+            init_query_profiler(app, db.engine)
+        app.register_blueprint(debug_bp)
+
+    # Signal receivers
+    low_stock.connect(log_low_stock, app)
 
     # Error Handlers
     @app.errorhandler(404)
@@ -49,12 +83,73 @@ def create_app(config_class=Config):
     def server_error(error):
         return jsonify({'error': 'Internal server error'}), 500
     
-    # Database Initialization (Dev/Startup)
-    with app.app_context():
-        # Create tables if they don't exist
-        db.create_all()
+    # The schema is managed by migrations.py: run `flask db-upgrade` once per
+    # deploy rather than creating tables on every worker boot.
+
+    # CLI Commands
+    @app.cli.command('db-upgrade')
+    @click.option('--target', type=int, default=None, help='Stop after this migration version')
+    def db_upgrade_command(target):
+        """Apply pending schema migrations and create the default admin"""
+        applied = upgrade_database(target)
+        print(f"Applied {len(applied)} migration(s)" if applied else "Database is up to date")
         create_default_admin(app)
 
+    @app.cli.command('db-status')
+    def db_status_command():
+        """List schema migrations and whether they have been applied"""
+        for version, name, applied_at in migration_status():
+            state = f"applied {applied_at:%Y-%m-%d %H:%M:%S}" if applied_at else "pending"
+            print(f"{version:>4}  {name:<50} {state}")
+
+    @app.cli.command('rebuild-stats')
+    def rebuild_stats_command():
+        """Recompute dashboard aggregates from the source tables"""
+        stats = rebuild_dashboard_stats()
+        db.session.commit()
+        print(f"Dashboard stats rebuilt: {stats.total_products} products, "
+              f"{stats.low_stock_count} low stock, {stats.total_transactions} transactions, "
+              f"revenue {stats.total_revenue:.2f}")
+
+    @app.cli.command('rebuild-rollups')
+    def rebuild_rollups_command():
+        """Recompute the sales report rollups from billing records"""
+        count = rebuild_sales_rollups()
+        db.session.commit()
+        print(f"Sales rollups rebuilt from {count} billing records")
+
+    @app.cli.command('sweep-sessions')
+    def sweep_sessions_command():
+        """Delete expired server-side sessions"""
+        print(f"Removed {sweep_expired_sessions()} expired sessions")
+
+    @app.cli.command('sweep-idempotency-keys')
+    def sweep_idempotency_keys_command():
+        """Delete expired checkout idempotency keys"""
+        count = sweep_idempotency_keys()
+        db.session.commit()
+        print(f"Removed {count} expired idempotency keys")
+
+    @app.cli.command('sweep-stock-events')
+    def sweep_stock_events_command():
+        """Delete stock stream events older than STOCK_EVENT_RETENTION"""
+        count = sweep_stock_events()
+        db.session.commit()
+        print(f"Removed {count} old stock events")
+
+    @app.cli.command('export-invoices')
+    @click.option('--start', required=True, help='First day (YYYY-MM-DD or ISO datetime)')
+    @click.option('--end', required=True, help='Last day, inclusive (YYYY-MM-DD or ISO datetime)')
+    @click.option('--output', '-o', required=True, type=click.Path(dir_okay=False), help='ZIP file to write')
+    @click.option('--workers', type=int, default=None, help='Render processes (default INVOICE_EXPORT_WORKERS)')
+    def export_invoices_command(start, end, output, workers):
+        """Render every invoice in a date range into a ZIP archive"""
+        from utils import parse_date_param
+        with open(output, 'wb') as f:
+            for chunk in iter_invoice_zip(parse_date_param(start), parse_date_param(end, end=True), workers):
+                f.write(chunk)
+        print(f"Invoices written to {output}")
+
     # Template Filters
     @app.template_filter('pluralize_unit')
     def pluralize_unit(unit, quantity):
@@ -98,4 +193,9 @@ def create_default_admin(app):
 app = create_app()
 
 if __name__ == '__main__':
+    # Dev server: bring the local database up to date first
+    with app.app_context():
+        upgrade_database()
+        create_default_admin(app)
+    clear_metrics_files(metrics_dir(app))
     app.run(debug=True, port=8000)
@@ -0,0 +1,327 @@
+"""
+Concurrent load test / benchmark for a local InventroBil instance.
+
+Starts the app under gunicorn on a fresh SQLite database (or targets an
+already running instance with --no-server), seeds cashier accounts and
+products through the public API, then runs N concurrent cashiers. Each one
+logs in and repeatedly looks up products (search + SKU scans), checks out
+a cart and downloads its invoice. Throughput and p50/p95/p99 latency are
+reported per endpoint and saved as JSON; --compare prints the change
+against an earlier run, e.g. one taken on the previous commit:
+
+    python benchmark.py --cashiers 16 --duration 60 -o bench/after.json
+    python benchmark.py --compare bench/before.json -o bench/after.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+import requests
+from verify_backend import APP_DIR, start_server, stop_server
+
+OWNER = {"username": "owner", "password": "owner123"}
+CASHIER_PASSWORD = "bench123"
+SKU_PREFIX = "BENCH"
+GST_RATE = 18
+
+# Endpoint names in report order
+ENDPOINTS = ("login", "product_search", "sku_lookup", "checkout", "invoice")
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class Recorder:
+    """Thread-safe latency and status collection per endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.errors = defaultdict(Counter)
+
+    def call(self, endpoint, method, url, **kwargs):
+        """Time one request; returns the response, or None if it raised"""
+        started = time.perf_counter()
+        try:
+            response = method(url, timeout=30, **kwargs)
+        except requests.RequestException as e:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.latencies[endpoint].append(elapsed)
+                self.errors[endpoint][type(e).__name__] += 1
+            return None
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.latencies[endpoint].append(elapsed)
+            self.statuses[endpoint][response.status_code] += 1
+            if response.status_code >= 400:
+                self.errors[endpoint][f"HTTP {response.status_code}"] += 1
+        return response
+
+    def summary(self, elapsed):
+        """Per-endpoint and overall numbers (latencies in milliseconds)"""
+        def describe(samples, statuses, errors):
+            samples = sorted(samples)
+            ms = lambda value: round(value * 1000, 2) if value is not None else None
+            return {
+                "requests": len(samples),
+                "errors": sum(errors.values()),
+                "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else None,
+                "mean_ms": ms(sum(samples) / len(samples)) if samples else None,
+                "p50_ms": ms(percentile(samples, 50)),
+                "p95_ms": ms(percentile(samples, 95)),
+                "p99_ms": ms(percentile(samples, 99)),
+                "max_ms": ms(samples[-1]) if samples else None,
+                "statuses": {str(code): count for code, count in sorted(statuses.items())},
+                "error_kinds": dict(errors),
+            }
+
+        endpoints = {
+            name: describe(self.latencies[name], self.statuses[name], self.errors[name])
+            for name in ENDPOINTS if self.latencies[name]
+        }
+        overall = describe(
+            [value for samples in self.latencies.values() for value in samples],
+            sum(self.statuses.values(), Counter()),
+            sum(self.errors.values(), Counter())
+        )
+        return endpoints, overall
+
+
+# ----- seeding -----
+
+def login(session, base_url, credentials):
+    response = session.post(f"{base_url}/login", json=credentials, timeout=30)
+    if response.status_code != 200 or not response.json().get("success"):
+        raise RuntimeError(f"Login failed for {credentials['username']}: {response.status_code} {response.text[:200]}")
+
+
+def seed(base_url, cashiers, products):
+    """Create cashier accounts and benchmark products through the API; returns the SKUs"""
+    owner = requests.Session()
+    login(owner, base_url, OWNER)
+
+    for index in range(cashiers):
+        response = owner.post(f"{base_url}/api/user", json={
+            "username": f"bench_cashier_{index}", "password": CASHIER_PASSWORD,
+            "role": "Cashier", "email": f"bench_cashier_{index}@example.com"
+        })
+        if response.status_code not in (201, 400):  # 400: left over from an earlier run
+            raise RuntimeError(f"Could not create cashier: {response.text[:200]}")
+
+    rng = random.Random(0)
+    skus = [f"{SKU_PREFIX}{index:06d}" for index in range(products)]
+    body = "".join(json.dumps({
+        "sku": sku,
+        "name": f"Bench item {index}",
+        "category": rng.choice(["Plumbing", "Electronics", "Hardware", "Others"]),
+        "stock": 1000000,
+        "price": round(rng.uniform(1, 500), 2),
+        "unit": "pc"
+    }) + "\n" for index, sku in enumerate(skus))
+    response = owner.post(f"{base_url}/api/import?mode=upsert", data=body.encode(),
+                          headers={"Content-Type": "application/x-ndjson"}, timeout=300)
+    if response.status_code != 200:
+        raise RuntimeError(f"Product import failed: {response.status_code} {response.text[:200]}")
+    return skus
+
+
+# ----- workload -----
+
+def run_cashier(index, base_url, skus, recorder, stop, iterations, max_cart, start_barrier):
+    rng = random.Random(index)
+    session = requests.Session()
+    start_barrier.wait()
+
+    response = recorder.call("login", session.post, f"{base_url}/login",
+                             json={"username": f"bench_cashier_{index}", "password": CASHIER_PASSWORD})
+    if response is None or response.status_code != 200:
+        return
+
+    done = 0
+    while not stop.is_set() and (iterations is None or done < iterations):
+        done += 1
+        # Cashier types part of a name, then scans each item's barcode
+        recorder.call("product_search", session.get, f"{base_url}/api/products/search",
+                      params={"q": f"item {rng.randrange(1000)}"})
+        cart = []
+        for sku in rng.sample(skus, rng.randint(1, max_cart)):
+            response = recorder.call("sku_lookup", session.get, f"{base_url}/api/products/sku/{sku}")
+            if response is not None and response.status_code == 200:
+                cart.append((response.json(), rng.randint(1, 3)))
+        if not cart:
+            continue
+
+        subtotal = round(sum(product["price"] * quantity for product, quantity in cart), 2)
+        gst_amount = round(subtotal * GST_RATE / 100, 2)
+        response = recorder.call("checkout", session.post, f"{base_url}/api/billing", json={
+            "items": [{"id": product["id"], "name": product["name"], "price": product["price"],
+                       "quantity": quantity} for product, quantity in cart],
+            "subtotal": subtotal, "discountPercent": 0, "discountAmount": 0,
+            "gstRate": GST_RATE, "gstAmount": gst_amount, "total": round(subtotal + gst_amount, 2)
+        })
+        if response is None or response.status_code != 201:
+            continue
+
+        recorder.call("invoice", session.get, f"{base_url}/api/billing/invoice/{response.json()['id']}")
+
+
+def run_load(base_url, skus, args):
+    recorder = Recorder()
+    stop = threading.Event()
+    barrier = threading.Barrier(args.cashiers + 1)
+    threads = [
+        threading.Thread(target=run_cashier, daemon=True, args=(
+            index, base_url, skus, recorder, stop, args.iterations, args.max_cart, barrier
+        ))
+        for index in range(args.cashiers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    # Start the clock once every cashier is ready to go
+    barrier.wait()
+    started = time.monotonic()
+    if args.iterations is None:
+        time.sleep(args.duration)
+        stop.set()
+    for thread in threads:
+        thread.join()
+    return recorder, time.monotonic() - started
+
+
+# ----- reporting -----
+
+def git_revision():
+    try:
+        revision = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR,
+                                           stderr=subprocess.DEVNULL, text=True).strip()
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD"], cwd=APP_DIR,
+                                stderr=subprocess.DEVNULL) != 0
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision + ("-dirty" if dirty else "")
+
+
+def print_report(results, baseline=None):
+    columns = ("requests", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms")
+    print(f"\n{'endpoint':<16}" + "".join(f"{column:>16}" for column in columns))
+    rows = list(results["endpoints"].items()) + [("overall", results["overall"])]
+    for name, stats in rows:
+        line = f"{name:<16}"
+        for column in columns:
+            value = stats.get(column)
+            cell = "-" if value is None else str(value)
+            old = ((baseline or {}).get("endpoints", {}).get(name) if name != "overall"
+                   else (baseline or {}).get("overall")) or {}
+            if column not in ("requests", "errors") and old.get(column) and value is not None:
+                cell += f" ({(value - old[column]) / old[column] * 100:+.0f}%)"
+            line += f"{cell:>16}"
+        print(line)
+    if baseline:
+        print(f"\nCompared with {baseline['meta'].get('git_revision')} "
+              f"({baseline['meta'].get('started_at')}); latency up / throughput down is worse")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cashiers", type=int, default=8, help="Concurrent simulated cashiers")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load (ignored with --iterations)")
+    parser.add_argument("--iterations", type=int, default=None, help="Sales per cashier instead of a duration")
+    parser.add_argument("--products", type=int, default=2000, help="Products to seed")
+    parser.add_argument("--max-cart", type=int, default=5, help="Largest cart, in distinct products")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers for the started server")
+    parser.add_argument("--port", type=int, default=8010, help="Port for the started server")
+    parser.add_argument("--database-url", default=None, help="Database for the started server (default: fresh SQLite)")
+    parser.add_argument("--no-server", action="store_true", help="Benchmark an already running instance")
+    parser.add_argument("--base-url", default=None, help="URL of the instance (default: the started server)")
+    parser.add_argument("--output", "-o", default=None, help="JSON results file (default: benchmarks/<time>-<rev>.json)")
+    parser.add_argument("--compare", default=None, help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    base_url = args.base_url or f"http://127.0.0.1:{args.port}"
+    workdir = tempfile.mkdtemp(prefix="inventrobil-bench-")
+    process = log = None
+    if not args.no_server:
+        env = {
+            "DATABASE_URL": args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+            "INVOICE_CACHE_DIR": os.path.join(workdir, "invoice_cache"),
+            "SECRET_KEY": "benchmark",
+        }
+        migrate_env = {**os.environ, **env, "ADMIN_USERNAME": OWNER["username"], "ADMIN_PASSWORD": OWNER["password"]}
+        subprocess.run([sys.executable, "-m", "flask", "--app", "app", "db-upgrade"], cwd=APP_DIR,
+                       env=migrate_env, check=True, stdout=subprocess.DEVNULL)
+        log = open(os.path.join(workdir, "server.log"), "wb")
+        process = start_server(
+            [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{args.port}",
+             "--workers", str(args.workers), "app:app"],
+            env=env, base_url=base_url, log=log
+        )
+
+    try:
+        print(f"Seeding {args.cashiers} cashiers and {args.products} products...")
+        skus = seed(base_url, args.cashiers, args.products)
+        print(f"Running {args.cashiers} cashiers "
+              f"{f'for {args.iterations} sales each' if args.iterations else f'for {args.duration:g}s'}...")
+        started_at = datetime.now().isoformat(timespec="seconds")
+        recorder, elapsed = run_load(base_url, skus, args)
+    finally:
+        if process:
+            stop_server(process)
+        if log:
+            log.close()
+            print(f"Server log: {log.name}")
+
+    endpoints, overall = recorder.summary(elapsed)
+    results = {
+        "meta": {
+            "started_at": started_at,
+            "git_revision": git_revision(),
+            "base_url": base_url,
+            "server": "external" if args.no_server else f"gunicorn --workers {args.workers}",
+            "database": "external" if args.no_server else (args.database_url or "sqlite (fresh)"),
+            "cashiers": args.cashiers,
+            "duration_s": round(elapsed, 2),
+            "iterations": args.iterations,
+            "products": args.products,
+            "max_cart": args.max_cart,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "endpoints": endpoints,
+        "overall": overall,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    output = args.output or os.path.join(
+        APP_DIR, "benchmarks",
+        f"{datetime.now():%Y%m%d-%H%M%S}-{results['meta']['git_revision'] or 'unknown'}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
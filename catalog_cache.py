@@ -0,0 +1,129 @@
+"""
+Per-worker SKU -> product cache for barcode scans.
+
+Every worker keeps an LRU of product lookups. Entries are invalidated from
+the stock event feed (see stock_events.py): everything that changes products
+bumps the shared `catalog` version in cache_versions and records which
+product ids changed, in the same transaction. A lookup first reads the
+version (a primary-key read); when it moved, the events since the last
+version this worker applied are read (one indexed range query) and only the
+entries of the changed products are dropped before the lookup is answered.
+A lookup therefore never returns data older than the last committed product
+change, and a checkout evicts the products it sold, not the whole cache.
+
+Unknown SKUs are cached too and forgotten whenever any product changes, as
+the event feed doesn't say which SKU a new product took. Resets (imports)
+and gaps in the feed (swept events) clear the whole cache.
+"""
+import threading
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy import select
+from extensions import db
+from models import Product, CacheVersion, product_columns, product_dict
+from utils import dialect_insert
+
+CATALOG_VERSION = 'catalog'
+
+
+def get_catalog_version():
+    """Current catalog version (0 if nothing was ever bumped)"""
+    version = db.session.execute(
+        select(CacheVersion.version).where(CacheVersion.name == CATALOG_VERSION)
+    ).scalar()
+    return version or 0
+
+
+def bump_catalog_version():
+    """Increment the catalog version in the current transaction and return it"""
+    table = CacheVersion.__table__
+    stmt = dialect_insert(table).values(name=CATALOG_VERSION, version=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['name'],
+        set_={'version': table.c.version + 1}
+    ).returning(table.c.version)
+    return db.session.execute(stmt).scalar()
+
+
+class ProductLookupCache:
+    """Thread-safe LRU of SKU -> product dict (or None for unknown SKUs)"""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._skus_by_id = {}
+        self._version = None  # Last catalog version applied to the entries
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def lookup(self, sku):
+        version = get_catalog_version()
+        if version != self._version:
+            self._sync(version)
+        with self._lock:
+            applied = self._version
+            if sku in self._entries:
+                self._entries.move_to_end(sku)
+                return self._entries[sku]
+
+        row = db.session.execute(
+            select(*product_columns()).where(Product.sku == sku)
+        ).first()
+        product = product_dict(row) if row else None
+
+        with self._lock:
+            # Only cache if no change was applied meanwhile: the row may predate it
+            if self._version == applied:
+                self._entries[sku] = product
+                if product is not None:
+                    self._skus_by_id.setdefault(product['id'], set()).add(sku)
+                if len(self._entries) > current_app.config['SKU_CACHE_SIZE']:
+                    self._evict(next(iter(self._entries)))
+        return product
+
+    def _sync(self, target):
+        """Apply the product changes up to catalog version `target` (waits for a concurrent sync)"""
+        from stock_events import load_messages
+        with self._sync_lock:
+            if self._version is None:
+                with self._lock:
+                    self._reset(target)
+            while self._version < target:
+                messages = load_messages(self._version, up_to=target)
+                with self._lock:
+                    if not messages:
+                        # The events were swept already: start over
+                        self._reset(target)
+                    for version, payload in messages:
+                        if version != self._version + 1 or payload['reset']:
+                            # Events missing (swept), or too much changed to list: start over
+                            self._reset(version)
+                            continue
+                        self._apply(version, payload)
+
+    def _apply(self, version, payload):
+        changed = [product['id'] for product in payload['products']] + payload['deleted']
+        for product_id in changed:
+            # Usually one SKU; more if the product's SKU was edited since it was cached
+            for sku in self._skus_by_id.pop(product_id, ()):
+                self._entries.pop(sku, None)
+        if changed:
+            # A new or renamed product may have taken a SKU cached as unknown
+            for sku in [sku for sku, product in self._entries.items() if product is None]:
+                del self._entries[sku]
+        self._version = version
+
+    def _reset(self, version):
+        self._entries.clear()
+        self._skus_by_id.clear()
+        self._version = version
+
+    def _evict(self, sku):
+        product = self._entries.pop(sku)
+        if product is not None:
+            skus = self._skus_by_id.get(product['id'], set())
+            skus.discard(sku)
+            if not skus:
+                self._skus_by_id.pop(product['id'], None)
+
+
+product_lookup_cache = ProductLookupCache()
@@ -12,10 +12,89 @@ class Config:
         
     SQLALCHEMY_DATABASE_URI = database_url or 'sqlite:///inventrobil.db'
     
+    # Engine tuning profile (see engine_profiles.py): auto, postgresql, sqlite or none
+    DB_ENGINE_PROFILE = os.environ.get('DB_ENGINE_PROFILE', 'auto')
+    # PostgreSQL profile: pool per worker process, pre-ping, server-side statement timeout
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))  # seconds to wait for a connection
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))  # seconds, -1 disables
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000))  # 0 disables
+    # SQLite profile: pragmas applied on every connection
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))  # bytes
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -65536))  # negative = KiB
+    
     # Admin Defaults for First Run
     ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME', 'owner')
     ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'owner123')
     
+    # Password hashing (Werkzeug method spec); older hashes are upgraded on login
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    # Login: concurrent hash verifications, extra queued ones, and wait limit (seconds)
+    LOGIN_HASH_WORKERS = int(os.environ.get('LOGIN_HASH_WORKERS', 2))
+    LOGIN_HASH_QUEUE = int(os.environ.get('LOGIN_HASH_QUEUE', 16))
+    LOGIN_HASH_TIMEOUT = float(os.environ.get('LOGIN_HASH_TIMEOUT', 10))
+    # Login: failed attempts per username allowed within the lockout window
+    LOGIN_MAX_FAILURES = int(os.environ.get('LOGIN_MAX_FAILURES', 5))
+    LOGIN_LOCKOUT_SECONDS = int(os.environ.get('LOGIN_LOCKOUT_SECONDS', 300))
+    
+    # Bulk inventory import: rows per upsert statement / savepoint
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 500))
+    
+    # Per-worker SKU lookup cache (entries)
+    SKU_CACHE_SIZE = int(os.environ.get('SKU_CACHE_SIZE', 4096))
+    
+    # Rendered invoice cache (defaults to <instance>/invoice_cache)
+    INVOICE_CACHE_DIR = os.environ.get('INVOICE_CACHE_DIR')
+    INVOICE_CACHE_MAX_BYTES = int(os.environ.get('INVOICE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+    # Render processes used by the bulk (ZIP) invoice export
+    INVOICE_EXPORT_WORKERS = int(os.environ.get('INVOICE_EXPORT_WORKERS', min(os.cpu_count() or 1, 8)))
+    # Bulk exports running at once per worker process (each with INVOICE_EXPORT_WORKERS renderers)
+    INVOICE_EXPORT_CONCURRENCY = int(os.environ.get('INVOICE_EXPORT_CONCURRENCY', 1))
+    
+    # Prometheus metrics on /metrics (see metrics.py); per-worker snapshots are
+    # shared through METRICS_DIR (defaults to <instance>/metrics)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))  # seconds
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # "Authorization: Bearer <token>"; unset: Owner session only
+    
+    # SQL profiler for development / staging / tests (see query_profiler.py); off by default
+    SQL_PROFILING = os.environ.get('SQL_PROFILING', 'false').lower() in ('1', 'true', 'yes')
+    SQL_PROFILE_N_PLUS_ONE = int(os.environ.get('SQL_PROFILE_N_PLUS_ONE', 5))  # same statement shape N times
+    SQL_PROFILE_SLOW_MS = float(os.environ.get('SQL_PROFILE_SLOW_MS', 100))
+    SQL_PROFILE_MAX_STATEMENTS = int(os.environ.get('SQL_PROFILE_MAX_STATEMENTS', 0))  # per request, 0 = no budget
+    SQL_PROFILE_LOG = os.environ.get('SQL_PROFILE_LOG', 'flagged')  # flagged, all or none
+    SQL_PROFILE_RAISE = os.environ.get('SQL_PROFILE_RAISE', 'false').lower() in ('1', 'true', 'yes')
+    SQL_PROFILE_HISTORY = int(os.environ.get('SQL_PROFILE_HISTORY', 100))  # reports kept for /debug/sql-profile
+    
+    # Billing id generator (see idgen.py): a distinct BILLING_NODE_ID (0-15) per host;
+    # BILLING_WORKER_ID (0-31) is added to the gunicorn worker slot (to separate two
+    # masters on one node), or is the worker id outside gunicorn
+    BILLING_NODE_ID = int(os.environ.get('BILLING_NODE_ID', 0))
+    BILLING_WORKER_ID = int(os.environ['BILLING_WORKER_ID']) if os.environ.get('BILLING_WORKER_ID') else None
+    
+    # How long a checkout Idempotency-Key is remembered (see idempotency.py)
+    IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 24 * 3600))  # seconds
+    
+    # Live stock stream for POS terminals (see stock_events.py), in seconds
+    STOCK_STREAM_POLL_INTERVAL = float(os.environ.get('STOCK_STREAM_POLL_INTERVAL', 1))
+    STOCK_STREAM_KEEPALIVE = float(os.environ.get('STOCK_STREAM_KEEPALIVE', 15))
+    STOCK_STREAM_MAX_AGE = float(os.environ.get('STOCK_STREAM_MAX_AGE', 300))  # then the browser reconnects
+    # Open streams per worker process; keep it well below GUNICORN_THREADS (see gunicorn.conf.py)
+    STOCK_STREAM_MAX_PER_WORKER = int(os.environ.get('STOCK_STREAM_MAX_PER_WORKER',
+                                                     int(os.environ.get('GUNICORN_THREADS', 16)) // 2))
+    STOCK_EVENT_RETENTION = int(os.environ.get('STOCK_EVENT_RETENTION', 24 * 3600))
+    
     # Session
-    SESSION_TYPE = 'filesystem'
+    # 'database' keeps sessions in the app database (shared by all workers/nodes,
+    # see sessions.py); any other value is handed to Flask-Session, e.g. 'filesystem'
+    SESSION_TYPE = os.environ.get('SESSION_TYPE', 'database')
     PERMANENT_SESSION_LIFETIME = 28800  # 8 hours
+    SESSION_CACHE_TTL = float(os.environ.get('SESSION_CACHE_TTL', 2))  # seconds, 0 disables
+    SESSION_REFRESH_INTERVAL = int(os.environ.get('SESSION_REFRESH_INTERVAL', 60))  # seconds
+    SESSION_SWEEP_INTERVAL = int(os.environ.get('SESSION_SWEEP_INTERVAL', 300))  # seconds, 0 disables
@@ -0,0 +1,83 @@
+"""
+Per-backend SQLAlchemy engine tuning, chosen by DB_ENGINE_PROFILE.
+
+* postgresql: a sized pool per worker process (DB_POOL_SIZE plus up to
+  DB_MAX_OVERFLOW extra connections), pre-ping so connections dropped by
+  the server or a proxy are replaced transparently, periodic recycling,
+  and a server-side statement_timeout so one runaway query cannot pin a
+  worker (and its locks) indefinitely.
+* sqlite: WAL journaling so readers no longer wait behind the writer,
+  synchronous=NORMAL (safe with WAL, fsyncs at checkpoints only), a
+  busy_timeout so concurrent writers queue instead of failing with
+  "database is locked", and mmap_size / cache_size for cheaper reads.
+  The pragmas are applied to every new connection.
+* none: plain SQLAlchemy defaults.
+
+The default, 'auto', picks postgresql or sqlite from the database URL.
+Anything set explicitly in SQLALCHEMY_ENGINE_OPTIONS wins over the profile.
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+ENGINE_PROFILES = ('auto', 'postgresql', 'sqlite', 'none')
+
+
+def resolve_engine_profile(config):
+    """Return the concrete profile name for this config"""
+    profile = config['DB_ENGINE_PROFILE']
+    if profile not in ENGINE_PROFILES:
+        raise ValueError(f"DB_ENGINE_PROFILE must be one of {', '.join(ENGINE_PROFILES)}")
+    if profile == 'auto':
+        backend = make_url(config['SQLALCHEMY_DATABASE_URI']).get_backend_name()
+        profile = backend if backend in ('postgresql', 'sqlite') else 'none'
+    return profile
+
+
+def engine_options(config, profile):
+    """create_engine() keyword arguments for a profile"""
+    if profile != 'postgresql':
+        return {}
+    options = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+    if config['DB_STATEMENT_TIMEOUT_MS']:
+        # Sent in the startup packet: no extra round trip per connection
+        options['connect_args'] = {'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']}"}
+    return options
+
+
+def sqlite_pragmas(config):
+    """(pragma, value) pairs applied to every new SQLite connection"""
+    return [
+        ('journal_mode', config['SQLITE_JOURNAL_MODE']),
+        ('synchronous', config['SQLITE_SYNCHRONOUS']),
+        ('busy_timeout', config['SQLITE_BUSY_TIMEOUT_MS']),
+        ('mmap_size', config['SQLITE_MMAP_SIZE']),
+        ('cache_size', config['SQLITE_CACHE_SIZE']),
+    ]
+
+
+def configure_engine(app):
+    """Merge the profile's options into SQLALCHEMY_ENGINE_OPTIONS (call before db.init_app)"""
+    profile = resolve_engine_profile(app.config)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        **engine_options(app.config, profile),
+        **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+    }
+    return profile
+
+
+def install_sqlite_pragmas(engine, pragmas):
+    """Run the PRAGMA statements on each connection the engine opens"""
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, _connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas:
+                cursor.execute(f'PRAGMA {name} = {value}')
+        finally:
+            cursor.close()
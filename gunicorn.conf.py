@@ -0,0 +1,43 @@
+"""
+gunicorn settings, loaded automatically from the working directory.
+
+Command-line flags (see the Dockerfile) still win for anything set here.
+"""
+import os
+from config import Config
+from metrics import clear_metrics_files
+from idgen import MAX_WORKER_ID, WORKER_SLOT_ENV
+
+# Worker processes (GUNICORN_WORKERS). Each has its own database pool, so
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) must fit the server's connection limit
+workers = int(os.environ.get('GUNICORN_WORKERS', min(2 * (os.cpu_count() or 1) + 1, 8)))
+
+# Threaded workers: an open /api/stream/stock connection holds a thread, not
+# a whole worker process as it would with the default sync workers. At most
+# STOCK_STREAM_MAX_PER_WORKER threads (half by default) serve streams, the
+# rest stay free for checkouts and the other endpoints
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+
+
+def on_starting(server):
+    """Drop per-worker metric snapshots left by a previous server run"""
+    # Same default as metrics.metrics_dir(): Flask's instance folder next to app.py
+    directory = Config.METRICS_DIR or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'metrics')
+    clear_metrics_files(directory)
+
+
+def pre_fork(server, worker):
+    """Give the new worker the lowest billing id slot no live worker holds"""
+    # Slots are offset by BILLING_WORKER_ID (see idgen.py), so fewer are left with an offset
+    slots = MAX_WORKER_ID + 1 - (Config.BILLING_WORKER_ID or 0)
+    taken = {getattr(w, 'billing_slot', None) for w in server.WORKERS.values()}
+    free = [slot for slot in range(slots) if slot not in taken]
+    if not free:
+        server.log.warning('More than %d workers: billing id slots are shared', slots)
+    worker.billing_slot = free[0] if free else worker.age % slots
+
+
+def post_fork(server, worker):
+    # Read by idgen.py in this worker process
+    os.environ[WORKER_SLOT_ENV] = str(worker.billing_slot)
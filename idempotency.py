@@ -0,0 +1,127 @@
+"""
+Idempotency-Key support for checkout (POST /api/billing).
+
+A client sends a unique Idempotency-Key header per sale and reuses it on
+retries. The key row is inserted at the *start* of the checkout
+transaction and filled with the response before commit, so:
+
+* a retry after success finds the committed row and gets the stored
+  response replayed (no second sale, no second stock decrement);
+* a retry racing the original blocks on the key's primary key until the
+  original commits (PostgreSQL) or is serialized by the write lock
+  (SQLite), then fails the insert and replays as well;
+* failed checkouts (409, 400, ...) roll the key back with everything else,
+  so the client can simply retry them.
+
+POST /api/billing/batch stores one key per sale in the same table (written
+together with the batch), so a sale first tried on /api/billing and later
+flushed from the offline queue is replayed, not recorded twice.
+
+Reusing a key for a different request body is rejected with 422. Keys are
+scoped per user and expire after IDEMPOTENCY_KEY_TTL seconds
+(`flask sweep-idempotency-keys` deletes old rows).
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta
+from flask import current_app, jsonify
+from sqlalchemy import delete, select
+from extensions import db
+from models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 100
+
+
+class IdempotencyKeyMismatch(Exception):
+    """The key was already used for a different request"""
+
+
+def request_fingerprint(payload):
+    """Stable hash of a JSON request body"""
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def validate_key(key):
+    """Return the stripped key, or raise ValueError"""
+    key = (key or '').strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f'{IDEMPOTENCY_HEADER} must be 1-{MAX_KEY_LENGTH} characters')
+    return key
+
+
+def _expiry_cutoff():
+    return datetime.utcnow() - timedelta(seconds=current_app.config['IDEMPOTENCY_KEY_TTL'])
+
+
+def find_completed(username, key, fingerprint):
+    """Return the stored entry for a finished request with this key, or None.
+
+    Raises IdempotencyKeyMismatch if the key belongs to a different request.
+    """
+    entry = db.session.get(IdempotencyKey, (username, key))
+    if entry is None:
+        return None
+    if entry.created_at < _expiry_cutoff():
+        # Expired: forget it so the key can be reused (caller commits)
+        db.session.delete(entry)
+        db.session.flush()
+        return None
+    if entry.request_hash != fingerprint:
+        raise IdempotencyKeyMismatch(f'{IDEMPOTENCY_HEADER} was already used for a different request')
+    return entry
+
+
+def load_keys(username, keys):
+    """Stored entries for several keys, {key: entry}, with one query (expired ones are dropped)"""
+    if not keys:
+        return {}
+    entries = db.session.execute(
+        select(IdempotencyKey).where(IdempotencyKey.created_by == username, IdempotencyKey.key.in_(set(keys)))
+    ).scalars().all()
+    cutoff = _expiry_cutoff()
+    expired = [entry.key for entry in entries if entry.created_at < cutoff]
+    if expired:
+        db.session.execute(delete(IdempotencyKey).where(
+            IdempotencyKey.created_by == username, IdempotencyKey.key.in_(expired)))
+    return {entry.key: entry for entry in entries if entry.created_at >= cutoff}
+
+
+def key_row(username, key, fingerprint, billing_id, status_code, body):
+    """A completed idempotency_keys row, for bulk inserts"""
+    return {'created_by': username, 'key': key, 'request_hash': fingerprint, 'billing_id': billing_id,
+            'status_code': status_code, 'response_body': json.dumps(body), 'created_at': datetime.utcnow()}
+
+
+def stored_body(entry):
+    return json.loads(entry.response_body)
+
+
+def claim_key(username, key, fingerprint):
+    """Insert the key row in the current transaction (IntegrityError if taken)"""
+    entry = IdempotencyKey(created_by=username, key=key, request_hash=fingerprint)
+    db.session.add(entry)
+    db.session.flush()
+    return entry
+
+
+def complete(entry, billing_id, status_code, body):
+    """Store the response on the claimed key, committed with the sale"""
+    entry.billing_id = billing_id
+    entry.status_code = status_code
+    entry.response_body = json.dumps(body)
+
+
+def replay(entry):
+    """Rebuild the stored response, marked as a replay"""
+    response = jsonify(stored_body(entry))
+    response.status_code = entry.status_code
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def sweep_idempotency_keys():
+    """Delete expired keys; returns how many were removed (caller commits)"""
+    result = db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < _expiry_cutoff()))
+    return result.rowcount
@@ -0,0 +1,119 @@
+"""
+Snowflake-style billing ids (BillingRecord.timestamp_id).
+
+The public invoice id used to be the checkout time in milliseconds, which
+collides as soon as two workers (or nodes) take a sale in the same
+millisecond. Ids are now composed, most significant bits first, of
+
+    41 bits  milliseconds since ID_EPOCH (good until ~2089)
+     4 bits  node id     (BILLING_NODE_ID, one per host/container)
+     5 bits  worker id   (gunicorn worker slot, see gunicorn.conf.py)
+     3 bits  sequence    (ids handed out in the same millisecond)
+
+53 bits in total, so ids stay exact in JavaScript numbers and keep the
+`timestamp_id` contract: a positive integer, unique, increasing with time
+(and larger than every old millisecond id). Generation needs no database
+round trip. Within a worker ids are strictly increasing; when the sequence
+runs out, or the clock steps backwards, the generator borrows the next
+millisecond instead of waiting.
+
+The worker id is the slot gunicorn assigned to this worker process (unique
+among the live workers of one master) plus BILLING_WORKER_ID (default 0),
+which offsets the slots of a second master on the same node, e.g. 16.
+Outside gunicorn BILLING_WORKER_ID alone is the worker id; with neither,
+the pid is used and a warning logged, as two processes may then share an
+id. Give every node its own BILLING_NODE_ID.
+"""
+import os
+import threading
+import time
+from flask import current_app
+
+# 2020-01-01T00:00:00Z in milliseconds
+ID_EPOCH_MS = 1577836800000
+
+NODE_BITS = 4
+WORKER_BITS = 5
+SEQUENCE_BITS = 3
+
+MAX_NODE_ID = (1 << NODE_BITS) - 1
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+# Set by gunicorn.conf.py in each worker process
+WORKER_SLOT_ENV = 'BILLING_WORKER_SLOT'
+
+
+class IdGenerator:
+    """Monotonic, thread-safe id source for one process"""
+
+    def __init__(self, node_id, worker_id):
+        if not 0 <= node_id <= MAX_NODE_ID:
+            raise ValueError(f'node id must be 0-{MAX_NODE_ID}')
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f'worker id must be 0-{MAX_WORKER_ID}')
+        self.prefix = (node_id << (WORKER_BITS + SEQUENCE_BITS)) | (worker_id << SEQUENCE_BITS)
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._sequence = 0
+
+    def next_id(self):
+        now = int(time.time() * 1000) - ID_EPOCH_MS
+        with self._lock:
+            if now > self._last_ms:
+                self._last_ms = now
+                self._sequence = 0
+            elif self._sequence < MAX_SEQUENCE:
+                # Same millisecond, or the clock went backwards: stay on the last one
+                self._sequence += 1
+            else:
+                self._last_ms += 1
+                self._sequence = 0
+            return (self._last_ms << (NODE_BITS + WORKER_BITS + SEQUENCE_BITS)) | self.prefix | self._sequence
+
+
+def split_id(value):
+    """Decompose an id: (milliseconds since the Unix epoch, node id, worker id, sequence)"""
+    sequence = value & MAX_SEQUENCE
+    worker_id = (value >> SEQUENCE_BITS) & MAX_WORKER_ID
+    node_id = (value >> (WORKER_BITS + SEQUENCE_BITS)) & MAX_NODE_ID
+    ms = (value >> (NODE_BITS + WORKER_BITS + SEQUENCE_BITS)) + ID_EPOCH_MS
+    return ms, node_id, worker_id, sequence
+
+
+def resolve_worker_id(configured=None):
+    """Worker id for this process: gunicorn slot + configured offset, see module docstring"""
+    slot = os.environ.get(WORKER_SLOT_ENV)
+    if slot is not None:
+        worker_id = int(slot) + (configured or 0)
+        if worker_id > MAX_WORKER_ID:
+            raise ValueError(f'BILLING_WORKER_ID {configured} + worker slot {slot} exceeds {MAX_WORKER_ID}')
+        return worker_id
+    if configured is not None:
+        return configured
+    current_app.logger.warning('No gunicorn worker slot or BILLING_WORKER_ID: billing worker id taken from the pid, '
+                               'ids may collide with another process on this node')
+    return os.getpid() & MAX_WORKER_ID
+
+
+_generator = None
+_generator_lock = threading.Lock()
+
+
+def _get_generator():
+    global _generator
+    generator = _generator
+    # A generator created before a fork belongs to the parent
+    if generator is None or generator.pid != os.getpid():
+        with _generator_lock:
+            if _generator is None or _generator.pid != os.getpid():
+                _generator = IdGenerator(current_app.config['BILLING_NODE_ID'],
+                                         resolve_worker_id(current_app.config['BILLING_WORKER_ID']))
+            generator = _generator
+    return generator
+
+
+def next_billing_id():
+    """Next timestamp_id for a billing record (needs an app context)"""
+    return _get_generator().next_id()
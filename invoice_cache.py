@@ -0,0 +1,144 @@
+"""
+On-disk cache of rendered invoice PDFs.
+
+A BillingRecord never changes after commit, so its PDF only depends on the
+record and on the renderer. Files are content-addressed by
+sha256(renderer version + timestamp_id): bumping INVOICE_RENDERER_VERSION
+in utils.py naturally invalidates every cached invoice. The cache is
+size-bounded; the least recently used files (by mtime, refreshed on every
+hit) are evicted first. Writes go through a temp file + rename so
+concurrent workers never serve a partial PDF.
+
+Each worker keeps a running estimate of the cache size: the total found by
+its last walk of the directory plus what it wrote since. The directory is
+only walked (one stat per file) when the estimate crosses
+INVOICE_CACHE_MAX_BYTES, and at least every SIZE_RESYNC_INTERVAL seconds
+to pick up other workers' writes; eviction then trims the cache to
+EVICT_TARGET_RATIO of the limit, so the next walk is many renders away.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from flask import current_app
+from utils import generate_invoice_pdf, INVOICE_RENDERER_VERSION
+from metrics import registry
+
+# Eviction trims the cache to this fraction of INVOICE_CACHE_MAX_BYTES
+EVICT_TARGET_RATIO = 0.9
+
+# Seconds after which a worker re-walks the cache to count other workers' writes
+SIZE_RESYNC_INTERVAL = 300
+
+# Cache directory -> (estimated bytes, monotonic time of the last walk)
+_size_estimates = {}
+_size_lock = threading.Lock()
+
+
+def invoice_cache_key(timestamp_id):
+    """Content address of an invoice, also used as its ETag"""
+    return hashlib.sha256(f'{INVOICE_RENDERER_VERSION}:{timestamp_id}'.encode()).hexdigest()
+
+
+def _cache_dir():
+    return current_app.config.get('INVOICE_CACHE_DIR') or os.path.join(current_app.instance_path, 'invoice_cache')
+
+
+def _cache_path(key):
+    # Two-character fan-out keeps directories small
+    return os.path.join(_cache_dir(), key[:2], f'{key}.pdf')
+
+
+def get_cached_invoice(timestamp_id):
+    """Return the path of a cached invoice (marking it recently used), or None"""
+    path = _cache_path(invoice_cache_key(timestamp_id))
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def store_invoice(timestamp_id, pdf_bytes):
+    """Atomically write a rendered invoice into the cache and return its path"""
+    path = _cache_path(invoice_cache_key(timestamp_id))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(pdf_bytes)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    _account_write(len(pdf_bytes))
+    return path
+
+
+def _account_write(size):
+    """Add a write to the size estimate; walk and evict only when it is over the limit or stale"""
+    root = _cache_dir()
+    max_bytes = current_app.config['INVOICE_CACHE_MAX_BYTES']
+    now = time.monotonic()
+    with _size_lock:
+        estimate, walked_at = _size_estimates.get(root, (None, None))
+        if estimate is not None and now - walked_at < SIZE_RESYNC_INTERVAL and estimate + size <= max_bytes:
+            _size_estimates[root] = (estimate + size, walked_at)
+            return
+    total = evict_invoices(max_bytes)
+    with _size_lock:
+        _size_estimates[root] = (total, now)
+
+
+def render_invoice(record, items):
+    """Render an invoice through the cache, returning the path of the PDF"""
+    path = get_cached_invoice(record.timestamp_id)
+    registry.inc('invoice_cache_lookups_total', ('hit' if path else 'miss',))
+    if path is None:
+        started = time.perf_counter()
+        pdf_bytes = generate_invoice_pdf(record, items).getvalue()
+        registry.observe('invoice_pdf_render_seconds', time.perf_counter() - started)
+        path = store_invoice(record.timestamp_id, pdf_bytes)
+    return path
+
+
+def evict_invoices(max_bytes):
+    """If the cache is over max_bytes, delete least recently used invoices until it
+    fits in EVICT_TARGET_RATIO of it; returns the bytes left"""
+    entries = []
+    total = 0
+    root = _cache_dir()
+    if not os.path.isdir(root):
+        return 0
+
+    for shard in os.scandir(root):
+        if not shard.is_dir():
+            continue
+        for entry in os.scandir(shard.path):
+            if not entry.name.endswith('.pdf'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+    if total <= max_bytes:
+        return total
+
+    target = max_bytes * EVICT_TARGET_RATIO
+    entries.sort()
+    for _mtime, size, path in entries:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass  # Another worker got there first
+        total -= size
+        if total <= target:
+            break
+    return total
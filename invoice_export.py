@@ -0,0 +1,182 @@
+"""
+Bulk invoice export: every invoice in a date range, as one ZIP archive.
+
+Records and their items are read in batches (the same bulk loaders the
+billing history uses), PDFs are rendered in parallel on a process pool with
+a bounded number of jobs in flight, and the archive is produced
+incrementally so neither the PDFs nor the ZIP are ever held in memory as a
+whole. Invoices already in the invoice cache are copied instead of
+re-rendered.
+
+Render processes come from a forkserver, not from forking the web worker:
+a gunicorn worker runs many threads (requests, stock poller, metrics
+flusher, ...) and a child forked mid-request could inherit a lock one of
+them held and hang. Each export starts up to INVOICE_EXPORT_WORKERS
+processes, so at most INVOICE_EXPORT_CONCURRENCY exports run per worker
+process; further ones raise ExportBusy.
+"""
+import io
+import multiprocessing
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+from flask import current_app
+from sqlalchemy import select
+from extensions import db
+from models import BillingRecord, billing_record_columns, billing_item_dict, load_billing_items
+from utils import generate_invoice_pdf
+from invoice_cache import get_cached_invoice
+
+# Records fetched (and items loaded) per round trip
+EXPORT_BATCH_SIZE = 200
+
+
+class _ZipOutput(io.RawIOBase):
+    """Write-only, unseekable sink that zipfile streams into and we drain"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _render_job(job):
+    """Process pool worker: render one invoice and return its bytes"""
+    timestamp_id, record, items = job
+    return timestamp_id, generate_invoice_pdf(record, items).getvalue()
+
+
+class ExportBusy(Exception):
+    """INVOICE_EXPORT_CONCURRENCY exports are already running in this process"""
+
+
+_export_slots = None
+_export_slots_lock = threading.Lock()
+
+
+def _get_export_slots():
+    global _export_slots
+    if _export_slots is None:
+        with _export_slots_lock:
+            if _export_slots is None:
+                _export_slots = threading.BoundedSemaphore(current_app.config['INVOICE_EXPORT_CONCURRENCY'])
+    return _export_slots
+
+
+def _render_context():
+    # The forkserver is started once, by a fresh interpreter that imports
+    # this module (and the PDF renderer) up front; render processes are forked
+    # from it, so they start quickly and never see the web worker's threads
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+class _ExportStream:
+    """Iterates an export and gives its slot back when closed, even if it never started"""
+
+    def __init__(self, chunks, release):
+        self._chunks = chunks
+        self._release = release
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        try:
+            self._chunks.close()
+        finally:
+            release, self._release = self._release, None
+            if release:
+                release()
+
+
+def iter_invoice_jobs(start, end):
+    """Yield (timestamp_id, record, items) for records with start <= timestamp < end.
+
+    record is a picklable snapshot with the attributes generate_invoice_pdf()
+    reads; items are plain dicts.
+    """
+    stmt = (
+        select(*billing_record_columns())
+        .where(BillingRecord.timestamp >= start, BillingRecord.timestamp < end)
+        .order_by(BillingRecord.timestamp, BillingRecord.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    for rows in db.session.execute(stmt).partitions():
+        items_by_record = load_billing_items([row.id for row in rows])
+        for row in rows:
+            items = [billing_item_dict(item) for item in items_by_record[row.id]]
+            yield row.timestamp_id, SimpleNamespace(**row._asdict()), items
+
+
+def iter_invoice_zip(start, end, workers=None):
+    """Iterator over the bytes of a ZIP archive holding every invoice in [start, end).
+
+    Raises ExportBusy right away when no export slot is free; close() the
+    iterator to give the slot back.
+    """
+    slots = _get_export_slots()
+    if not slots.acquire(blocking=False):
+        raise ExportBusy()
+    return _ExportStream(_iter_invoice_zip(start, end, workers), slots.release)
+
+
+def _iter_invoice_zip(start, end, workers):
+    workers = workers or current_app.config['INVOICE_EXPORT_WORKERS']
+    max_in_flight = workers * 4
+    output = _ZipOutput()
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=_render_context())
+    try:
+        with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            # Results are written in submission order; each entry is either a
+            # cached file path or a pending render.
+            pending = deque()
+
+            def write_oldest():
+                job, cached_path, future = pending.popleft()
+                name = f'invoice_{job[0]}.pdf'
+                if cached_path:
+                    try:
+                        archive.write(cached_path, name)
+                        return output.drain()
+                    except FileNotFoundError:
+                        # Evicted in the meantime: render it here instead
+                        future = None
+                pdf_bytes = future.result()[1] if future else _render_job(job)[1]
+                archive.writestr(name, pdf_bytes)
+                return output.drain()
+
+            for job in iter_invoice_jobs(start, end):
+                cached_path = get_cached_invoice(job[0])
+                future = None if cached_path else pool.submit(_render_job, job)
+                pending.append((job, cached_path, future))
+                while len(pending) >= max_in_flight:
+                    yield write_oldest()
+
+            while pending:
+                yield write_oldest()
+
+        # Central directory, written when the archive is closed
+        yield output.drain()
+    finally:
+        pool.shutdown(cancel_futures=True)
@@ -0,0 +1,127 @@
+"""
+Login protection: bounded password-hashing pool and failure throttling.
+
+Password verification (scrypt / PBKDF2) is deliberately expensive. At
+shift change a burst of logins could otherwise occupy every worker thread
+with hashing. Verification therefore runs on a small per-process thread
+pool; hashlib releases the GIL while hashing, so those threads really run
+in parallel. At most LOGIN_HASH_WORKERS hashes run at once and at most
+LOGIN_HASH_QUEUE more may wait. Beyond that the login is refused straight
+away with 503 + Retry-After instead of piling up.
+
+Repeated failures for a username are counted in a sliding window and,
+past LOGIN_MAX_FAILURES, further attempts are rejected before any hashing
+happens. The counters are per worker process, so the effective limit is
+multiplied by the number of workers; it is a cheap load shield, not an
+account lockout. Usernames whose window has passed are forgotten, and at
+most MAX_TRACKED_USERNAMES are tracked, so a flood of made-up usernames
+can't grow the table without bound.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from flask import current_app
+
+# Usernames with recent failures tracked per process; the stalest go first
+MAX_TRACKED_USERNAMES = 10000
+
+
+class HashPoolBusy(Exception):
+    """The hashing pool and its queue are full"""
+
+
+class HashPool:
+    def __init__(self):
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    workers = current_app.config['LOGIN_HASH_WORKERS']
+                    self._slots = threading.BoundedSemaphore(workers + current_app.config['LOGIN_HASH_QUEUE'])
+                    self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='login-hash')
+
+    def run(self, fn, *args):
+        """Run fn(*args) on the pool and wait for it; raises HashPoolBusy when saturated"""
+        self._ensure_started()
+        if not self._slots.acquire(blocking=False):
+            raise HashPoolBusy()
+
+        # Hashing helpers read the configured method, so give them an app context
+        app = current_app._get_current_object()
+        def call():
+            with app.app_context():
+                return fn(*args)
+
+        try:
+            future = self._executor.submit(call)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=current_app.config['LOGIN_HASH_TIMEOUT'])
+        except TimeoutError:
+            raise HashPoolBusy()
+
+
+class LoginThrottle:
+    def __init__(self):
+        # username -> recent failure times, ordered by each username's last failure
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def _recent(self, username, now, window):
+        attempts = self._failures.get(username)
+        if attempts is None:
+            return None
+        while attempts and attempts[0] <= now - window:
+            attempts.popleft()
+        if not attempts:
+            del self._failures[username]
+            return None
+        return attempts
+
+    def retry_after(self, username):
+        """Seconds until username may try again, or 0 if it isn't throttled"""
+        window = current_app.config['LOGIN_LOCKOUT_SECONDS']
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._recent(username, now, window)
+            if attempts is None or len(attempts) < current_app.config['LOGIN_MAX_FAILURES']:
+                return 0
+            return max(1, int(attempts[0] + window - now))
+
+    def record_failure(self, username):
+        window = current_app.config['LOGIN_LOCKOUT_SECONDS']
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._recent(username, now, window)
+            if attempts is None:
+                attempts = deque(maxlen=current_app.config['LOGIN_MAX_FAILURES'])
+            else:
+                # Re-inserted below, moving it to the end
+                del self._failures[username]
+            attempts.append(now)
+            self._failures[username] = attempts
+            self._prune(now, window)
+
+    def _prune(self, now, window):
+        # The front holds the stalest usernames, so this stops at the first live one
+        while self._failures:
+            username, attempts = next(iter(self._failures.items()))
+            if attempts[-1] > now - window and len(self._failures) <= MAX_TRACKED_USERNAMES:
+                break
+            del self._failures[username]
+
+    def reset(self, username):
+        with self._lock:
+            self._failures.pop(username, None)
+
+
+hash_pool = HashPool()
+login_throttle = LoginThrottle()
@@ -0,0 +1,290 @@
+"""
+Request, SQL and invoice instrumentation exposed in the Prometheus text
+format on /metrics.
+
+Every request (all blueprints) records its latency, status, in-flight count
+and the number of SQL statements it ran plus the time they took, counted
+with SQLAlchemy engine events. Invoice rendering records the PDF render
+time and cache hits/misses.
+
+Each gunicorn worker keeps its numbers in memory and a background thread
+writes them to METRICS_DIR/metrics-<pid>.json every METRICS_FLUSH_INTERVAL
+seconds (atomically, via rename). /metrics merges every worker's file, so
+whichever worker serves the scrape reports the whole server; the serving
+worker's own numbers are always current, the others' at most one interval
+old. Files of workers that have exited are kept so counters never go
+backwards (their gauges are dropped); gunicorn.conf.py clears the directory
+when the master starts.
+"""
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+# Histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+PDF_RENDER_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+ROUTE_LABELS = ('blueprint', 'endpoint', 'method')
+
+# name -> (type, help, label names, histogram buckets)
+METRIC_DEFINITIONS = {
+    'http_requests_total': (
+        'counter', 'HTTP requests by route, method and status', ROUTE_LABELS + ('status',), None),
+    'http_request_duration_seconds': (
+        'histogram', 'HTTP request latency', ROUTE_LABELS, LATENCY_BUCKETS),
+    'http_requests_in_flight': (
+        'gauge', 'HTTP requests currently being served', ROUTE_LABELS, None),
+    'http_request_sql_statements': (
+        'histogram', 'SQL statements executed per HTTP request', ROUTE_LABELS, SQL_COUNT_BUCKETS),
+    'http_request_sql_duration_seconds': (
+        'histogram', 'Time spent executing SQL per HTTP request', ROUTE_LABELS, LATENCY_BUCKETS),
+    'db_statements_total': (
+        'counter', 'SQL statements executed, inside requests or in background work', ('source',), None),
+    'db_statement_duration_seconds_total': (
+        'counter', 'Time spent executing SQL, inside requests or in background work', ('source',), None),
+    'invoice_pdf_render_seconds': (
+        'histogram', 'Invoice PDF render time', (), PDF_RENDER_BUCKETS),
+    'invoice_cache_lookups_total': (
+        'counter', 'Invoice cache lookups by result', ('result',), None),
+}
+
+
+class MetricsRegistry:
+    """In-process metric values: {name: {label values tuple: value}}"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {name: {} for name in METRIC_DEFINITIONS}
+        self._flusher_pid = None
+
+    def inc(self, name, labels=(), amount=1):
+        """Add to a counter or gauge (use a negative amount to decrement a gauge)"""
+        with self._lock:
+            series = self._values[name]
+            series[labels] = series.get(labels, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        """Record one histogram observation"""
+        buckets = METRIC_DEFINITIONS[name][3]
+        with self._lock:
+            series = self._values[name]
+            # Per-bucket (non-cumulative) counts, then sum and count
+            state = series.get(labels)
+            if state is None:
+                state = series[labels] = [0] * (len(buckets) + 2)
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    state[index] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: [[list(labels), value if not isinstance(value, list) else list(value)]
+                       for labels, value in series.items()]
+                for name, series in self._values.items()
+            }
+
+    # ----- cross-worker files -----
+
+    def flush(self, directory):
+        """Atomically write this process's snapshot into the shared directory"""
+        os.makedirs(directory, exist_ok=True)
+        payload = json.dumps({'pid': os.getpid(), 'metrics': self.snapshot()})
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(payload)
+            os.replace(tmp_path, os.path.join(directory, f'metrics-{os.getpid()}.json'))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def ensure_flusher(self, app):
+        """Start one flush thread per process (after any fork by gunicorn)"""
+        if self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        thread = threading.Thread(target=self._flush_forever, args=(app,), name='metrics-flusher', daemon=True)
+        thread.start()
+
+    def _flush_forever(self, app):
+        interval = app.config['METRICS_FLUSH_INTERVAL']
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush(metrics_dir(app))
+            except Exception:
+                app.logger.exception('Metrics flush failed')
+
+
+registry = MetricsRegistry()
+
+
+def metrics_dir(app):
+    return app.config.get('METRICS_DIR') or os.path.join(app.instance_path, 'metrics')
+
+
+def clear_metrics_files(directory):
+    """Remove every worker snapshot (call when the server starts)"""
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect(app):
+    """Merge every worker's snapshot: {name: {label values tuple: value}}"""
+    directory = metrics_dir(app)
+    registry.flush(directory)
+
+    merged = {name: {} for name in METRIC_DEFINITIONS}
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue  # Removed or being replaced right now
+        alive = _process_alive(data['pid'])
+        for name, series in data['metrics'].items():
+            if name not in merged:
+                continue  # Written by an older version of this module
+            kind = METRIC_DEFINITIONS[name][0]
+            if kind == 'gauge' and not alive:
+                continue
+            target = merged[name]
+            for labels, value in series:
+                labels = tuple(labels)
+                if kind == 'histogram':
+                    current = target.setdefault(labels, [0] * len(value))
+                    target[labels] = [a + b for a, b in zip(current, value)]
+                else:
+                    target[labels] = target.get(labels, 0) + value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics(merged):
+    """Prometheus text exposition format (version 0.0.4)"""
+    lines = []
+    for name, (kind, help_text, label_names, buckets) in METRIC_DEFINITIONS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(merged[name].items()):
+            if kind != 'histogram':
+                lines.append(f'{name}{_label_text(label_names, labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, value):
+                cumulative += count
+                lines.append(f'{name}_bucket{_label_text(label_names, labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_bucket{_label_text(label_names, labels, [("le", "+Inf")])} {value[-1]}')
+            lines.append(f'{name}_sum{_label_text(label_names, labels)} {_number(value[-2])}')
+            lines.append(f'{name}_count{_label_text(label_names, labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+# ----- hooks -----
+
+def _route_labels():
+    rule = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+    return (request.blueprint or '', rule, request.method)
+
+
+def _before_request():
+    registry.ensure_flusher(current_app._get_current_object())
+    g.metrics_started = time.perf_counter()
+    g.metrics_labels = _route_labels()
+    g.metrics_sql_count = 0
+    g.metrics_sql_time = 0.0
+    registry.inc('http_requests_in_flight', g.metrics_labels)
+
+
+def _after_request(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def _teardown_request(_error):
+    labels = g.pop('metrics_labels', None)
+    if labels is None:
+        return  # before_request never ran (e.g. an earlier hook failed)
+    elapsed = time.perf_counter() - g.pop('metrics_started')
+    status = g.pop('metrics_status', 500)
+    registry.inc('http_requests_in_flight', labels, -1)
+    registry.inc('http_requests_total', labels + (str(status),))
+    registry.observe('http_request_duration_seconds', elapsed, labels)
+    registry.observe('http_request_sql_statements', g.metrics_sql_count, labels)
+    registry.observe('http_request_sql_duration_seconds', g.metrics_sql_time, labels)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['metrics_query_started'].pop()
+    _record_statement(time.perf_counter() - started)
+
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('metrics_query_started'):
+        started = conn.info['metrics_query_started'].pop()
+        _record_statement(time.perf_counter() - started)
+
+
+def _record_statement(elapsed):
+    source = 'background'
+    if has_request_context() and 'metrics_sql_count' in g:
+        g.metrics_sql_count += 1
+        g.metrics_sql_time += elapsed
+        source = 'request'
+    registry.inc('db_statements_total', (source,))
+    registry.inc('db_statement_duration_seconds_total', (source,), elapsed)
+
+
+def init_metrics(app, engine):
+    """Install the request hooks on the app and the SQL hooks on its engine"""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
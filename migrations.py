@@ -0,0 +1,239 @@
+"""
+Versioned schema migrations (`flask db-upgrade`, `flask db-status`).
+
+db.create_all() only ever creates missing tables: it never adds an index or
+a column to a table that already exists, and it used to run on every
+worker boot. Schema changes are now numbered migrations, applied once, in
+order, and recorded in `schema_migrations`:
+
+* migration 1 creates any missing tables from the models, so a fresh
+  database comes out complete and the later migrations find nothing to do;
+* every step is idempotent (IF NOT EXISTS, inspector checks), so a
+  migration interrupted half-way is simply run again;
+* on PostgreSQL indexes are built with CREATE INDEX CONCURRENTLY (writes
+  keep flowing while it builds) and columns are only added with a constant
+  default, which is a catalog-only change since PostgreSQL 11 (no table
+  rewrite). DDL runs outside a transaction with a short lock_timeout so it
+  gives up rather than queueing every other query behind it;
+* a PostgreSQL advisory lock stops two deploys from migrating at once.
+
+Append new migrations at the end; never renumber or edit an applied one,
+and keep the models in step so fresh databases match migrated ones.
+"""
+from datetime import datetime
+from sqlalchemy import inspect, insert, select, text
+from extensions import db
+from sqlalchemy.exc import OperationalError
+from models import (SchemaMigration, IdempotencyKey, StockEvent, ProductTombstone, LOW_STOCK_THRESHOLD,
+                    PRODUCT_SEARCH_TABLE, PRODUCT_SEARCH_DDL)
+
+# Arbitrary application-wide key for pg_advisory_lock
+MIGRATION_LOCK_KEY = 4621873
+
+# How long a DDL statement may wait for a table lock on PostgreSQL
+DDL_LOCK_TIMEOUT = '5s'
+
+MIGRATIONS = []
+
+
+def migration(version, name):
+    """Register a migration step; steps run in version order"""
+    def register(func):
+        MIGRATIONS.append((version, name, func))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return func
+    return register
+
+
+class MigrationContext:
+    """What a migration gets: an autocommit connection plus idempotent DDL helpers"""
+
+    def __init__(self, conn, log):
+        self.conn = conn
+        self.dialect = conn.dialect.name
+        self.log = log
+
+    def execute(self, sql, **params):
+        self.log(f'  {sql}')
+        return self.conn.execute(text(sql), params)
+
+    def has_column(self, table, column):
+        return any(c['name'] == column for c in inspect(self.conn).get_columns(table))
+
+    def add_column(self, table, column, ddl):
+        """ALTER TABLE ... ADD COLUMN unless it exists (use constant defaults only)"""
+        if not self.has_column(table, column):
+            self.execute(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}')
+
+    def drop_default(self, table, column, ddl):
+        """Drop a column's server default; ddl is the column's declaration as added"""
+        default = next(c['default'] for c in inspect(self.conn).get_columns(table) if c['name'] == column)
+        if default is None:
+            return
+        if self.dialect == 'postgresql':
+            self.execute(f'ALTER TABLE {table} ALTER COLUMN {column} DROP DEFAULT')
+        elif self.dialect == 'sqlite':
+            # SQLite has no ALTER COLUMN, but a default only lives in the schema
+            # SQL, so editing it there is safe (the "otheralter" procedure of
+            # https://www.sqlite.org/lang_altertable.html)
+            self.execute('BEGIN')
+            try:
+                sql = self.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :table",
+                                   table=table).scalar()
+                declared = f'{column} {ddl}'
+                if declared not in sql:
+                    raise RuntimeError(f'{table}.{column} is not declared as "{declared}"')
+                # Rows that predate ADD COLUMN don't store the column: they read
+                # the default from the schema SQL, so write it into them first
+                self.execute(f'UPDATE {table} SET {column} = {column}')
+                schema_version = self.execute('PRAGMA schema_version').scalar()
+                self.execute('PRAGMA writable_schema = ON')
+                self.execute("UPDATE sqlite_master SET sql = :schema WHERE type = 'table' AND name = :table",
+                             schema=sql.replace(declared, f'{column} {ddl.split(" DEFAULT ")[0]}'), table=table)
+                self.execute(f'PRAGMA schema_version = {schema_version + 1}')
+                self.execute('PRAGMA writable_schema = OFF')
+                self.execute('COMMIT')
+            except Exception:
+                self.execute('ROLLBACK')
+                raise
+
+    def create_index(self, name, table, columns, where=None, using=None):
+        """CREATE INDEX IF NOT EXISTS, built CONCURRENTLY on PostgreSQL"""
+        predicate = f' WHERE {where}' if where else ''
+        if self.dialect == 'postgresql':
+            self._drop_invalid_index(name)
+            method = f' USING {using}' if using else ''
+            self.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table}{method} '
+                         f'({", ".join(columns)}){predicate}')
+        else:
+            self.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({", ".join(columns)}){predicate}')
+
+    def _drop_invalid_index(self, name):
+        # A failed CONCURRENTLY build leaves an INVALID index behind that
+        # IF NOT EXISTS would happily skip
+        invalid = self.conn.execute(text(
+            'SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+            'WHERE c.relname = :name AND NOT i.indisvalid'
+        ), {'name': name}).first()
+        if invalid:
+            self.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+# ----- migrations -----
+
+@migration(1, 'Create missing tables')
+def _create_tables(ctx):
+    db.metadata.create_all(ctx.conn)
+
+
+@migration(2, 'Index billing history and invoice lookups')
+def _index_billing(ctx):
+    ctx.create_index('ix_billing_items_billing_id', 'billing_items', ['billing_id'])
+    ctx.create_index('ix_billing_items_product_id', 'billing_items', ['product_id'])
+    ctx.create_index('ix_billing_records_timestamp', 'billing_records', ['timestamp', 'id'])
+    ctx.create_index('ix_billing_records_created_by', 'billing_records', ['created_by', 'timestamp', 'id'])
+
+
+@migration(3, 'Index product filters and search')
+def _index_products(ctx):
+    ctx.create_index('ix_products_category', 'products', ['category'])
+    ctx.create_index('ix_products_name', 'products', ['name'])
+    if ctx.dialect == 'postgresql':
+        ctx.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        ctx.create_index('ix_products_name_trgm', 'products', ['name gin_trgm_ops'], using='gin')
+        ctx.create_index('ix_products_sku_trgm', 'products', ['sku gin_trgm_ops'], using='gin')
+
+
+@migration(4, 'Per-product reorder levels')
+def _add_reorder_level(ctx):
+    ctx.add_column('products', 'reorder_level', f'INTEGER NOT NULL DEFAULT {LOW_STOCK_THRESHOLD}')
+    ctx.create_index('ix_products_low_stock', 'products', ['id'], where='stock < reorder_level')
+
+
+@migration(5, 'Checkout idempotency keys')
+def _add_idempotency_keys(ctx):
+    IdempotencyKey.__table__.create(ctx.conn, checkfirst=True)
+
+
+@migration(6, 'Stock event stream')
+def _add_stock_events(ctx):
+    StockEvent.__table__.create(ctx.conn, checkfirst=True)
+
+
+@migration(7, 'Product versions and tombstones for delta sync')
+def _add_product_versions(ctx):
+    # No server default: a new row has to stay NULL until publish_catalog_change
+    # stamps it. Existing rows predate every version a client can have seen.
+    ctx.add_column('products', 'version', 'BIGINT')
+    ctx.execute('UPDATE products SET version = 0 WHERE version IS NULL')
+    ctx.create_index('ix_products_version', 'products', ['version'])
+    ProductTombstone.__table__.create(ctx.conn, checkfirst=True)
+
+
+@migration(8, 'Index product search on every searched column')
+def _index_product_search(ctx):
+    if ctx.dialect == 'postgresql':
+        # Without it the name / sku / category OR falls back to a sequential scan
+        ctx.create_index('ix_products_category_trgm', 'products', ['category gin_trgm_ops'], using='gin')
+    elif ctx.dialect == 'sqlite':
+        try:
+            ctx.execute(PRODUCT_SEARCH_DDL[0])
+        except OperationalError as e:
+            # No FTS5 or no trigram tokenizer (SQLite < 3.34): search keeps scanning with LIKE
+            ctx.log(f'  skipped, FTS5 trigram index unavailable: {e.orig}')
+            return
+        for statement in PRODUCT_SEARCH_DDL[1:]:
+            ctx.execute(statement)
+        # Index the products that already exist
+        ctx.execute(f"INSERT INTO {PRODUCT_SEARCH_TABLE}({PRODUCT_SEARCH_TABLE}) VALUES ('rebuild')")
+
+
+@migration(9, 'Drop the products.version default')
+def _drop_product_version_default(ctx):
+    # Databases that ran migration 7 before it stopped adding DEFAULT 0
+    ctx.drop_default('products', 'version', 'BIGINT DEFAULT 0')
+
+
+# ----- runner -----
+
+def _applied_versions(conn):
+    return {row.version: row.applied_at for row in conn.execute(select(SchemaMigration.version, SchemaMigration.applied_at))}
+
+
+def upgrade_database(target=None, log=print):
+    """Apply pending migrations up to target (default: all); returns the versions applied"""
+    applied = []
+    with db.engine.connect() as conn:
+        conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+        ctx = MigrationContext(conn, log)
+        if ctx.dialect == 'postgresql':
+            conn.execute(text(f"SET lock_timeout = '{DDL_LOCK_TIMEOUT}'"))
+            # Index builds may legitimately outlast the app's statement_timeout
+            conn.execute(text('SET statement_timeout = 0'))
+            conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': MIGRATION_LOCK_KEY})
+        try:
+            SchemaMigration.__table__.create(conn, checkfirst=True)
+            done = _applied_versions(conn)
+            for version, name, func in MIGRATIONS:
+                if version in done or (target is not None and version > target):
+                    continue
+                log(f'Applying migration {version}: {name}')
+                func(ctx)
+                conn.execute(insert(SchemaMigration).values(version=version, name=name, applied_at=datetime.utcnow()))
+                applied.append(version)
+        finally:
+            if ctx.dialect == 'postgresql':
+                conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': MIGRATION_LOCK_KEY})
+                conn.execute(text('RESET lock_timeout'))
+                conn.execute(text('RESET statement_timeout'))
+    return applied
+
+
+def migration_status():
+    """Return [(version, name, applied_at or None)] for every known migration"""
+    with db.engine.connect() as conn:
+        if not inspect(conn).has_table(SchemaMigration.__tablename__):
+            done = {}
+        else:
+            done = _applied_versions(conn)
+    return [(version, name, done.get(version)) for version, name, _func in MIGRATIONS]
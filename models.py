@@ -1,6 +1,10 @@
 from datetime import datetime
+from sqlalchemy import DDL, event, case, or_, func, null, text, column
 from extensions import db
 
+# Default reorder level: products below it count as "low stock"
+LOW_STOCK_THRESHOLD = 10
+
 class User(db.Model):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
@@ -18,27 +22,86 @@ class User(db.Model):
 
 class Product(db.Model):
     __tablename__ = 'products'
+    __table_args__ = (
+        # Trigram GIN indexes let PostgreSQL answer the product search's
+        # ILIKE '%term%' without a sequential scan (see find_products). The
+        # search ORs all three columns, and a BitmapOr needs every branch
+        # indexed, so category must have one too.
+        db.Index('ix_products_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        db.Index('ix_products_sku_trgm', 'sku', postgresql_using='gin',
+                 postgresql_ops={'sku': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        db.Index('ix_products_category_trgm', 'category', postgresql_using='gin',
+                 postgresql_ops={'category': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        # Partial index holding only the products below their reorder level,
+        # so /api/products/low-stock never scans the healthy ones. The
+        # predicate must stay identical to low_stock_condition().
+        db.Index('ix_products_low_stock', 'id',
+                 postgresql_where=db.text('stock < reorder_level'),
+                 sqlite_where=db.text('stock < reorder_level')),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    category = db.Column(db.String(50))
+    name = db.Column(db.String(100), nullable=False, index=True)
+    category = db.Column(db.String(50), index=True)
     stock = db.Column(db.Integer, default=0)
     price = db.Column(db.Float, nullable=False)
     sku = db.Column(db.String(50), unique=True)
     unit = db.Column(db.String(20), default='pc')
+    # Stock level below which the product counts as low stock
+    reorder_level = db.Column(db.Integer, nullable=False, default=LOW_STOCK_THRESHOLD,
+                              server_default=str(LOW_STOCK_THRESHOLD))
+    # Catalog version of the last change, for delta syncs (GET /api/products?since=).
+    # Every INSERT / UPDATE resets it to NULL and publish_catalog_change()
+    # stamps the NULL rows with the new version before commit.
+    version = db.Column(db.BigInteger, index=True, default=null(), onupdate=null())
 
     def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'category': self.category,
-            'stock': self.stock,
-            'price': self.price,
-            'sku': self.sku,
-            'unit': self.unit
-        }
+        return product_dict(self)
+
+# The trigram operator classes above live in the pg_trgm extension
+event.listen(
+    Product.__table__, 'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)
+
+# SQLite has no trigram indexes; an FTS5 table with the trigram tokenizer
+# (SQLite 3.34+) plays their part. It indexes name, sku and category of
+# products (external content, rowid = products.id) and is kept in step by
+# triggers, so every write path, ORM or Core, updates it. Stock and price
+# updates don't touch it.
+PRODUCT_SEARCH_TABLE = 'products_search'
+PRODUCT_SEARCH_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {PRODUCT_SEARCH_TABLE} USING fts5("
+    "name, sku, category, content='products', content_rowid='id', tokenize='trigram')",
+    f"CREATE TRIGGER IF NOT EXISTS {PRODUCT_SEARCH_TABLE}_ai AFTER INSERT ON products BEGIN "
+    f"INSERT INTO {PRODUCT_SEARCH_TABLE}(rowid, name, sku, category) VALUES (new.id, new.name, new.sku, new.category); "
+    "END",
+    f"CREATE TRIGGER IF NOT EXISTS {PRODUCT_SEARCH_TABLE}_ad AFTER DELETE ON products BEGIN "
+    f"INSERT INTO {PRODUCT_SEARCH_TABLE}({PRODUCT_SEARCH_TABLE}, rowid, name, sku, category) "
+    "VALUES ('delete', old.id, old.name, old.sku, old.category); "
+    "END",
+    f"CREATE TRIGGER IF NOT EXISTS {PRODUCT_SEARCH_TABLE}_au AFTER UPDATE OF name, sku, category ON products BEGIN "
+    f"INSERT INTO {PRODUCT_SEARCH_TABLE}({PRODUCT_SEARCH_TABLE}, rowid, name, sku, category) "
+    "VALUES ('delete', old.id, old.name, old.sku, old.category); "
+    f"INSERT INTO {PRODUCT_SEARCH_TABLE}(rowid, name, sku, category) VALUES (new.id, new.name, new.sku, new.category); "
+    "END",
+)
+# Trigram matching needs at least 3 characters; shorter terms use LIKE
+PRODUCT_SEARCH_MIN_TERM = 3
+
+def _supports_product_search(ddl, target, bind, **kw):
+    return bind.dialect.name == 'sqlite' and bind.dialect.server_version_info >= (3, 34)
+
+for _statement in PRODUCT_SEARCH_DDL:
+    event.listen(Product.__table__, 'after_create', DDL(_statement).execute_if(callable_=_supports_product_search))
 
 class BillingRecord(db.Model):
     __tablename__ = 'billing_records'
+    __table_args__ = (
+        # History pages: newest first, optionally for one cashier (keyset on timestamp, id)
+        db.Index('ix_billing_records_timestamp', 'timestamp', 'id'),
+        db.Index('ix_billing_records_created_by', 'created_by', 'timestamp', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)  # Using auto-increment or we can use the timestamp ID logic if strict compatibility is needed, but auto-increment is better for DB
     # Note: Frontend might expect 'id' to be the timestamp one. We will adapt in the route.
     timestamp_id = db.Column(db.BigInteger, unique=True) # To store the frontend-style ID
@@ -53,35 +116,256 @@ class BillingRecord(db.Model):
     
     items = db.relationship('BillingItem', backref='billing_record', cascade='all, delete-orphan')
 
-    def to_dict(self):
-        return {
-            'id': self.timestamp_id,
-            'timestamp': self.timestamp.isoformat(),
-            'subtotal': self.subtotal,
-            'discountPercent': self.discount_percent,
-            'discountAmount': self.discount_amount,
-            'gstRate': self.gst_rate,
-            'gstAmount': self.gst_amount,
-            'total': self.total,
-            'created_by': self.created_by,
-            'items': [item.to_dict() for item in self.items]
-        }
+    def to_dict(self, items=None):
+        if items is None:
+            items = [item.to_dict() for item in self.items]
+        return billing_record_dict(self, items)
 
 class BillingItem(db.Model):
     __tablename__ = 'billing_items'
     id = db.Column(db.Integer, primary_key=True)
-    billing_id = db.Column(db.Integer, db.ForeignKey('billing_records.id'), nullable=False)
-    product_id = db.Column(db.Integer) # Keep it even if product deleted
+    billing_id = db.Column(db.Integer, db.ForeignKey('billing_records.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, index=True) # Keep it even if product deleted
     product_name = db.Column(db.String(100)) # Snapshot
     quantity = db.Column(db.Integer)
     price = db.Column(db.Float) # Snapshot price at time of sale
     unit = db.Column(db.String(20), default='pc')
     
     def to_dict(self):
-        return {
-            'id': self.product_id, # Frontend expects 'id' to be product id in the items list usually, effectively reconstructing the payload
-            'name': self.product_name,
-            'quantity': self.quantity,
-            'price': self.price,
-            'unit': self.unit
-        }
+        return billing_item_dict(self)
+
+class DashboardStats(db.Model):
+    """Single-row rollup of the /home dashboard numbers.
+
+    Kept up to date by the routes that change products or billing records
+    (see stats.py), so the dashboard never has to scan the source tables.
+    """
+    __tablename__ = 'dashboard_stats'
+    id = db.Column(db.Integer, primary_key=True)
+    total_products = db.Column(db.Integer, nullable=False, default=0)
+    low_stock_count = db.Column(db.Integer, nullable=False, default=0)
+    total_transactions = db.Column(db.Integer, nullable=False, default=0)
+    total_revenue = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class SalesRollupProduct(db.Model):
+    """Sales per product per hour/day bucket (see rollups.py)"""
+    __tablename__ = 'sales_rollup_product'
+    granularity = db.Column(db.String(5), primary_key=True) # 'hour' or 'day'
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    product_id = db.Column(db.Integer, primary_key=True)
+    product_name = db.Column(db.String(100)) # Latest snapshot seen in the bucket
+    transactions = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    gross = db.Column(db.Float, nullable=False, default=0.0) # price * quantity
+    discount = db.Column(db.Float, nullable=False, default=0.0) # Share of the bill discount
+    gst = db.Column(db.Float, nullable=False, default=0.0) # Share of the bill GST
+    revenue = db.Column(db.Float, nullable=False, default=0.0) # gross - discount + gst
+
+class SalesRollupCashier(db.Model):
+    """Sales per cashier per hour/day bucket (see rollups.py)"""
+    __tablename__ = 'sales_rollup_cashier'
+    granularity = db.Column(db.String(5), primary_key=True) # 'hour' or 'day'
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    cashier = db.Column(db.String(80), primary_key=True)
+    transactions = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    gross = db.Column(db.Float, nullable=False, default=0.0) # Bill subtotals
+    discount = db.Column(db.Float, nullable=False, default=0.0)
+    gst = db.Column(db.Float, nullable=False, default=0.0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0) # Bill totals
+
+class IdempotencyKey(db.Model):
+    """Client-supplied Idempotency-Key of a checkout and the response it produced (see idempotency.py)"""
+    __tablename__ = 'idempotency_keys'
+    created_by = db.Column(db.String(80), primary_key=True) # Keys are scoped per user
+    key = db.Column(db.String(100), primary_key=True)
+    request_hash = db.Column(db.String(64), nullable=False)
+    billing_id = db.Column(db.Integer, db.ForeignKey('billing_records.id', ondelete='CASCADE'))
+    status_code = db.Column(db.Integer)
+    response_body = db.Column(db.Text) # JSON
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+class StockEvent(db.Model):
+    """Product changes pushed to POS terminals, fanned out between workers (see stock_events.py)"""
+    __tablename__ = 'stock_events'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, index=True) # Catalog version of the change
+    payload = db.Column(db.Text, nullable=False) # JSON
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+class ProductTombstone(db.Model):
+    """Deleted products, so delta syncs can report them (see publish_catalog_change)"""
+    __tablename__ = 'product_tombstones'
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    version = db.Column(db.BigInteger, nullable=False, index=True) # Catalog version of the deletion
+
+class SchemaMigration(db.Model):
+    """Migrations applied to this database (see migrations.py)"""
+    __tablename__ = 'schema_migrations'
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class CacheVersion(db.Model):
+    """Monotonic version counters shared by all workers.
+
+    Writers bump a counter in the same transaction as their change; readers
+    compare it with the version their in-process cache was filled at.
+    """
+    __tablename__ = 'cache_versions'
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+class WebSession(db.Model):
+    """Server-side session store (see sessions.py)"""
+    __tablename__ = 'web_sessions'
+    session_id = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+    expiry = db.Column(db.DateTime, nullable=False, index=True)
+
+# ============= BULK SERIALIZATION =============
+# The helpers below accept ORM instances or plain result rows with the same
+# attribute names, so listings can skip per-row ORM overhead entirely.
+
+# Field order used by the inventory export/import formats
+PRODUCT_FIELDS = ('id', 'name', 'category', 'stock', 'price', 'sku', 'unit', 'reorder_level')
+
+def product_dict(product):
+    return {field: getattr(product, field) for field in PRODUCT_FIELDS}
+
+def product_columns():
+    """Columns needed by product_dict(), for use with query.with_entities()"""
+    return tuple(getattr(Product, field) for field in PRODUCT_FIELDS)
+
+def low_stock_condition():
+    """SQL filter for products below their reorder level (matches ix_products_low_stock)"""
+    # Kept as a bare comparison: SQLite only uses a partial index whose
+    # predicate appears verbatim in the query, so no COALESCE here.
+    return Product.stock < Product.reorder_level
+
+def find_products(term, category=None, in_stock=False, limit=20):
+    """Ranked, limited product search returning product dicts.
+
+    An empty term lists products alphabetically. Otherwise matches are
+    case-insensitive substrings of name, SKU or category, ranked exact SKU,
+    SKU prefix, name prefix, word prefix, then anything else.
+    """
+    query = Product.query.with_entities(*product_columns())
+    if category:
+        query = query.filter(Product.category == category)
+    if in_stock:
+        query = query.filter(Product.stock > 0)
+
+    term = term.strip().lower()
+    if not term:
+        return [product_dict(row) for row in query.order_by(Product.name, Product.id).limit(limit)]
+
+    # Escape LIKE wildcards typed by the user
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    contains = f'%{escaped}%'
+    prefix = f'{escaped}%'
+
+    # SQLite's LIKE is already case-insensitive for ASCII; ilike() would wrap
+    # every comparison in lower() and make the scan several times slower
+    case_insensitive_like = db.engine.dialect.name == 'sqlite'
+    def matches(column, pattern):
+        if case_insensitive_like:
+            return column.like(pattern, escape='\\')
+        return column.ilike(pattern, escape='\\')
+
+    rank = case(
+        (func.lower(Product.sku) == term, 0),
+        (matches(Product.sku, prefix), 1),
+        (matches(Product.name, prefix), 2),
+        (matches(Product.name, f'% {prefix}'), 3),
+        else_=4
+    )
+    if case_insensitive_like and len(term) >= PRODUCT_SEARCH_MIN_TERM and _has_product_search_table():
+        # The same substring match, answered by the FTS5 trigram index
+        phrase = '"' + term.replace('"', '""') + '"'
+        query = query.filter(Product.id.in_(
+            text(f'SELECT rowid FROM {PRODUCT_SEARCH_TABLE} WHERE {PRODUCT_SEARCH_TABLE} MATCH :search_phrase')
+            .bindparams(search_phrase=phrase).columns(column('rowid'))
+        ))
+    else:
+        query = query.filter(or_(
+            matches(Product.name, contains),
+            matches(Product.sku, contains),
+            matches(Product.category, contains)
+        ))
+    rows = query.order_by(rank, Product.name, Product.id).limit(limit)
+    return [product_dict(row) for row in rows]
+
+_product_search_tables = {}
+
+def _has_product_search_table():
+    """Whether this SQLite database has the FTS5 product index (migration 8; needs SQLite 3.34+)"""
+    engine = db.engine
+    if engine not in _product_search_tables:
+        _product_search_tables[engine] = db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {'name': PRODUCT_SEARCH_TABLE}
+        ).first() is not None
+    return _product_search_tables[engine]
+
+# Max ids per IN (...) clause, comfortably below SQLite's bound-parameter limit
+IN_CLAUSE_CHUNK = 500
+
+def billing_record_dict(record, items):
+    return {
+        'id': record.timestamp_id,
+        'timestamp': record.timestamp.isoformat(),
+        'subtotal': record.subtotal,
+        'discountPercent': record.discount_percent,
+        'discountAmount': record.discount_amount,
+        'gstRate': record.gst_rate,
+        'gstAmount': record.gst_amount,
+        'total': record.total,
+        'created_by': record.created_by,
+        'items': items
+    }
+
+def billing_item_dict(item):
+    return {
+        'id': item.product_id, # Frontend expects 'id' to be product id in the items list usually, effectively reconstructing the payload
+        'name': item.product_name,
+        'quantity': item.quantity,
+        'price': item.price,
+        'unit': item.unit
+    }
+
+def billing_record_columns():
+    """Columns needed by billing_record_dict(), for use with query.with_entities()"""
+    return (
+        BillingRecord.id, BillingRecord.timestamp_id, BillingRecord.timestamp,
+        BillingRecord.subtotal, BillingRecord.discount_percent, BillingRecord.discount_amount,
+        BillingRecord.gst_rate, BillingRecord.gst_amount, BillingRecord.total,
+        BillingRecord.created_by
+    )
+
+def load_billing_items(billing_ids):
+    """Fetch the items of many billing records in batched queries.
+
+    Returns {billing_id: [item rows in insertion order]}.
+    """
+    items_by_record = {billing_id: [] for billing_id in billing_ids}
+    ids = list(items_by_record)
+    for start in range(0, len(ids), IN_CLAUSE_CHUNK):
+        rows = db.session.query(
+            BillingItem.billing_id, BillingItem.product_id, BillingItem.product_name,
+            BillingItem.quantity, BillingItem.price, BillingItem.unit
+        ).filter(
+            BillingItem.billing_id.in_(ids[start:start + IN_CLAUSE_CHUNK])
+        ).order_by(BillingItem.billing_id, BillingItem.id)
+        for row in rows:
+            items_by_record[row.billing_id].append(row)
+    return items_by_record
+
+def serialize_billing_records(records):
+    """Serialize billing records without a per-record items query"""
+    items_by_record = load_billing_items([record.id for record in records])
+    return [
+        billing_record_dict(record, [billing_item_dict(item) for item in items_by_record[record.id]])
+        for record in records
+    ]
@@ -0,0 +1,83 @@
+"""
+Set-based repricing rules (POST /api/products/reprice).
+
+A rule is turned into one SQL expression over products.price, so a whole
+category or SKU list is repriced by a single UPDATE:
+
+    base  = price * (1 + percent / 100)   or   price + amount   or   a fixed price
+    units = nearest / up / down of (base - ending) / step
+    price = max(units * step + ending, min_price), snapped to cents
+
+`step` defaults to 0.01 (plain cents) and `ending` to 0. With step 1 and
+ending 0.99, 4.37 becomes 3.99 (down or nearest) or 4.99 (up); a price
+that already fits the rule is left alone.
+"""
+from sqlalchemy import case, literal
+from models import Product
+from utils import sql_floor
+
+ROUNDING_MODES = ('nearest', 'up', 'down')
+
+# Absorbs float noise so e.g. (4.99 - 0.99) / 1 is not rounded up to 5
+EPSILON = 1e-9
+
+
+def _number(data, field, default=None):
+    value = data.get(field, default)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{field} must be a number')
+
+
+def parse_reprice_rule(data):
+    """Validate a reprice request body; returns the rule as a dict or raises ValueError"""
+    changes = {field: _number(data, field) for field in ('percent', 'amount', 'price')}
+    given = [field for field, value in changes.items() if value is not None]
+    if len(given) != 1:
+        raise ValueError('Give exactly one of percent, amount or price')
+
+    rule = {'change': given[0], 'value': changes[given[0]]}
+    rule['step'] = _number(data, 'step', 0.01)
+    rule['ending'] = _number(data, 'ending', 0)
+    rule['min_price'] = _number(data, 'minPrice', 0)
+    rule['mode'] = data.get('rounding', 'nearest')
+    if rule['step'] <= 0:
+        raise ValueError('step must be positive')
+    if not 0 <= rule['ending'] < rule['step']:
+        raise ValueError('ending must be at least 0 and below step')
+    if rule['min_price'] < 0:
+        raise ValueError('minPrice must not be negative')
+    if rule['mode'] not in ROUNDING_MODES:
+        raise ValueError(f"rounding must be one of {', '.join(ROUNDING_MODES)}")
+    if rule['change'] == 'percent' and rule['value'] <= -100:
+        raise ValueError('percent must be above -100')
+    return rule
+
+
+def _rounded(value, step, ending, mode):
+    scaled = (value - ending) / step
+    if mode == 'up':
+        units = -sql_floor(-scaled + EPSILON)
+    elif mode == 'down':
+        units = sql_floor(scaled + EPSILON)
+    else:
+        units = sql_floor(scaled + 0.5)
+    return units * step + ending
+
+
+def reprice_expression(rule):
+    """SQL expression for a product's new price under the rule"""
+    if rule['change'] == 'percent':
+        base = Product.price * (1 + rule['value'] / 100)
+    elif rule['change'] == 'amount':
+        base = Product.price + rule['value']
+    else:
+        base = literal(rule['value'])
+
+    price = _rounded(base, rule['step'], rule['ending'], rule['mode'])
+    price = case((price < rule['min_price'], rule['min_price']), else_=price)
+    # Snap to whole cents so float noise never reaches the stored price
+    return sql_floor(price * 100 + 0.5) / 100.0
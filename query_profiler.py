@@ -0,0 +1,229 @@
+"""
+Opt-in SQL profiler for development, staging and tests (SQL_PROFILING).
+
+Every statement a request executes is recorded and grouped by its
+normalized shape (literals, bound parameters and IN-lists collapsed), and
+the request is flagged when:
+
+* one shape runs SQL_PROFILE_N_PLUS_ONE or more times (the classic N+1:
+  a query per row of a previous result; executemany batches don't count),
+* a statement takes longer than SQL_PROFILE_SLOW_MS,
+* the request runs more than SQL_PROFILE_MAX_STATEMENTS statements.
+
+Reports go to the app log (SQL_PROFILE_LOG: 'flagged', 'all' or 'none')
+and to a per-worker ring buffer served on /debug/sql-profile (Owner only).
+Responses carry X-SQL-Statements / X-SQL-Time-Ms headers. With
+SQL_PROFILE_RAISE a flagged request raises QueryBudgetExceeded, which makes
+it fail loudly under the test client; `query_budget()` applies the same
+checks to any block of code:
+
+    with app.app_context(), query_budget(max_statements=8, n_plus_one=3):
+        client.post('/api/billing', json=cart)
+
+Disabled (the default), nothing is hooked and there is no overhead.
+"""
+import re
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from flask import current_app, g, request
+from sqlalchemy import event
+from extensions import db
+
+# Profiles collecting statements in the current context (requests and
+# query_budget() blocks can nest, so every active one records)
+_active_profiles = ContextVar('sql_profiles', default=())
+
+_WHITESPACE = re.compile(r'\s+')
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PARAMETER = re.compile(r'%\(\w+\)s|%s|\$\d+|:\w+|\?')
+_PARAMETER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+# Groups listed per report (most time-consuming first)
+REPORT_TOP_GROUPS = 20
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a profiled request or block breaks its SQL budgets"""
+
+    def __init__(self, report):
+        self.report = report
+        super().__init__(describe_problems(report))
+
+
+def normalize_statement(statement):
+    """Reduce a SQL statement to its shape: same query, different values -> same string"""
+    shape = _STRING_LITERAL.sub('?', statement)
+    shape = _PARAMETER.sub('?', shape)
+    shape = _NUMBER_LITERAL.sub('?', shape)
+    shape = _PARAMETER_LIST.sub('(?, ...)', shape)
+    return _WHITESPACE.sub(' ', shape).strip()
+
+
+class QueryProfile:
+    """Statements recorded for one request or block"""
+
+    def __init__(self, label):
+        self.label = label
+        self.statements = []  # (shape, seconds, executemany)
+
+    def record(self, statement, seconds, executemany):
+        self.statements.append((normalize_statement(statement), seconds, executemany))
+
+    @property
+    def total_seconds(self):
+        return sum(seconds for _shape, seconds, _many in self.statements)
+
+    def report(self, n_plus_one=None, slow_ms=None, max_statements=None):
+        groups = {}
+        slow = []
+        for shape, seconds, executemany in self.statements:
+            group = groups.setdefault(shape, {'shape': shape, 'count': 0, 'total_ms': 0.0,
+                                              'max_ms': 0.0, 'executemany': False})
+            group['count'] += 1
+            group['total_ms'] += seconds * 1000
+            group['max_ms'] = max(group['max_ms'], seconds * 1000)
+            group['executemany'] = group['executemany'] or executemany
+            if slow_ms and seconds * 1000 > slow_ms:
+                slow.append({'shape': shape, 'ms': round(seconds * 1000, 2)})
+
+        repeated = [
+            {'shape': group['shape'], 'count': group['count']}
+            for group in groups.values()
+            if n_plus_one and group['count'] >= n_plus_one and not group['executemany']
+        ]
+        top = sorted(groups.values(), key=lambda group: group['total_ms'], reverse=True)[:REPORT_TOP_GROUPS]
+        for group in top:
+            group['total_ms'] = round(group['total_ms'], 2)
+            group['max_ms'] = round(group['max_ms'], 2)
+
+        return {
+            'label': self.label,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'statements': len(self.statements),
+            'sql_ms': round(self.total_seconds * 1000, 2),
+            'groups': top,
+            'n_plus_one': repeated,
+            'slow': slow,
+            'budget_exceeded': bool(max_statements) and len(self.statements) > max_statements,
+            'max_statements': max_statements,
+        }
+
+
+def is_flagged(report):
+    return bool(report['n_plus_one'] or report['slow'] or report['budget_exceeded'])
+
+
+def describe_problems(report):
+    """One line per problem found in a report"""
+    problems = [f"N+1: {entry['count']}x {entry['shape']}" for entry in report['n_plus_one']]
+    problems += [f"slow ({entry['ms']} ms): {entry['shape']}" for entry in report['slow']]
+    if report['budget_exceeded']:
+        problems.append(f"{report['statements']} statements (budget {report['max_statements']})")
+    return f"{report['label']}: " + '; '.join(problems) if problems else f"{report['label']}: ok"
+
+
+# ----- engine hooks -----
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active_profiles.get():
+        conn.info.setdefault('profiler_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profiles = _active_profiles.get()
+    if profiles and conn.info.get('profiler_started'):
+        elapsed = time.perf_counter() - conn.info['profiler_started'].pop()
+        for profile in profiles:
+            profile.record(statement, elapsed, executemany)
+
+
+def install_engine_hooks(engine):
+    """Start recording statements on this engine (idempotent)"""
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+@contextmanager
+def profile_queries(label):
+    """Record the statements run inside the block into a new QueryProfile"""
+    profile = QueryProfile(label)
+    token = _active_profiles.set(_active_profiles.get() + (profile,))
+    try:
+        yield profile
+    finally:
+        _active_profiles.reset(token)
+
+
+@contextmanager
+def query_budget(max_statements=None, n_plus_one=None, slow_ms=None, label='query_budget'):
+    """Raise QueryBudgetExceeded if the block breaks any of the given budgets (needs an app context)"""
+    install_engine_hooks(db.engine)
+    with profile_queries(label) as profile:
+        yield profile
+    report = profile.report(n_plus_one=n_plus_one, slow_ms=slow_ms, max_statements=max_statements)
+    if is_flagged(report):
+        raise QueryBudgetExceeded(report)
+
+
+# ----- request hooks -----
+
+class RequestProfiler:
+    def __init__(self, app):
+        self.n_plus_one = app.config['SQL_PROFILE_N_PLUS_ONE']
+        self.slow_ms = app.config['SQL_PROFILE_SLOW_MS']
+        self.max_statements = app.config['SQL_PROFILE_MAX_STATEMENTS']
+        self.log_mode = app.config['SQL_PROFILE_LOG']
+        self.raise_on_flag = app.config['SQL_PROFILE_RAISE']
+        self.history = deque(maxlen=app.config['SQL_PROFILE_HISTORY'])
+
+    def before_request(self):
+        g.sql_profile = QueryProfile(f'{request.method} {request.path}')
+        g.sql_profile_token = _active_profiles.set(_active_profiles.get() + (g.sql_profile,))
+
+    def _stop(self):
+        token = g.pop('sql_profile_token', None)
+        if token is not None:
+            _active_profiles.reset(token)
+        return token is not None
+
+    def after_request(self, response):
+        if not self._stop():
+            return response
+        profile = g.pop('sql_profile')
+
+        report = profile.report(self.n_plus_one, self.slow_ms, self.max_statements)
+        report['status'] = response.status_code
+        report['endpoint'] = request.endpoint
+        report['flagged'] = is_flagged(report)
+        self.history.append(report)
+
+        response.headers['X-SQL-Statements'] = str(report['statements'])
+        response.headers['X-SQL-Time-Ms'] = str(report['sql_ms'])
+        if report['flagged'] and self.log_mode in ('flagged', 'all'):
+            current_app.logger.warning('SQL profile %s', describe_problems(report))
+        elif self.log_mode == 'all':
+            current_app.logger.info('SQL profile %s: %d statements, %.2f ms',
+                                    report['label'], report['statements'], report['sql_ms'])
+        if report['flagged'] and self.raise_on_flag:
+            raise QueryBudgetExceeded(report)
+        return response
+
+    def teardown_request(self, _error):
+        # The request failed before after_request could close the profile
+        self._stop()
+
+
+def init_query_profiler(app, engine):
+    """Profile every request of the app (only called when SQL_PROFILING is on)"""
+    profiler = RequestProfiler(app)
+    app.extensions['sql_profiler'] = profiler
+    install_engine_hooks(engine)
+    app.before_request(profiler.before_request)
+    app.after_request(profiler.after_request)
+    app.teardown_request(profiler.teardown_request)
+    return profiler
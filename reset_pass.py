@@ -2,6 +2,7 @@ from app import create_app
 from extensions import db
 from models import User
 from utils import hash_password
+from migrations import upgrade_database
 
 app = create_app()
 
@@ -13,7 +14,7 @@ users_to_reset = [
 
 with app.app_context():
     # Ensure tables exist (in case they were deleted)
-    db.create_all()
+    upgrade_database()
     
     print("Resetting passwords...")
     for user_data in users_to_reset:
@@ -0,0 +1,119 @@
+"""
+Time-bucketed sales rollups backing /api/reports/sales.
+
+Every sale adds its numbers to one hourly and one daily row per product
+and per cashier, with additive upserts in the same transaction as the
+sale. A report then reads only the buckets in the requested range, never
+billing_records / billing_items. The bill-level discount and GST are
+shared out to products in proportion to each line's price * quantity.
+`rebuild_sales_rollups()` (`flask rebuild-rollups`) recomputes everything
+from the billing tables, e.g. after a backfill.
+"""
+from collections import defaultdict
+from sqlalchemy import select, delete
+from extensions import db
+from models import (SalesRollupProduct, SalesRollupCashier, BillingRecord,
+                    billing_record_columns, load_billing_items)
+from utils import dialect_insert
+
+GRANULARITIES = ('hour', 'day')
+
+# Records read per round trip when rebuilding
+REBUILD_BATCH_SIZE = 500
+
+METRICS = ('transactions', 'units', 'gross', 'discount', 'gst', 'revenue')
+
+
+def bucket_start(timestamp, granularity):
+    """Truncate a timestamp to the start of its hour or day"""
+    if granularity == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _accumulate(product_rows, cashier_rows, record, items):
+    """Add one sale to in-memory rollup rows keyed by their primary keys.
+
+    items are mappings with product_id, product_name, quantity and price.
+    """
+    line_gross = [(item['price'] or 0) * (item['quantity'] or 0) for item in items]
+    total_gross = sum(line_gross)
+    units = sum(item['quantity'] or 0 for item in items)
+
+    for granularity in GRANULARITIES:
+        bucket = bucket_start(record.timestamp, granularity)
+
+        cashier = cashier_rows[(granularity, bucket, record.created_by or '')]
+        cashier['transactions'] += 1
+        cashier['units'] += units
+        cashier['gross'] += record.subtotal or 0
+        cashier['discount'] += record.discount_amount or 0
+        cashier['gst'] += record.gst_amount or 0
+        cashier['revenue'] += record.total or 0
+
+        for item, gross in zip(items, line_gross):
+            share = gross / total_gross if total_gross else 0
+            discount = (record.discount_amount or 0) * share
+            gst = (record.gst_amount or 0) * share
+            product = product_rows[(granularity, bucket, item['product_id'])]
+            product['product_name'] = item['product_name']
+            product['transactions'] += 1
+            product['units'] += item['quantity'] or 0
+            product['gross'] += gross
+            product['discount'] += discount
+            product['gst'] += gst
+            product['revenue'] += gross - discount + gst
+
+
+def _new_rollup_rows():
+    return defaultdict(lambda: dict.fromkeys(METRICS, 0))
+
+
+def _upsert_additive(model, key_columns, rows):
+    """Add rows onto existing rollup rows (INSERT ... ON CONFLICT DO UPDATE SET x = x + excluded.x)"""
+    if not rows:
+        return
+    table = model.__table__
+    values = [dict(zip(key_columns, key), **metrics) for key, metrics in rows.items()]
+    stmt = dialect_insert(table)
+    update = {metric: table.c[metric] + stmt.excluded[metric] for metric in METRICS}
+    if 'product_name' in table.c:
+        update['product_name'] = stmt.excluded.product_name
+    stmt = stmt.on_conflict_do_update(index_elements=list(key_columns), set_=update)
+    db.session.execute(stmt, values)
+
+
+def _flush(product_rows, cashier_rows):
+    _upsert_additive(SalesRollupProduct, ('granularity', 'bucket_start', 'product_id'), product_rows)
+    _upsert_additive(SalesRollupCashier, ('granularity', 'bucket_start', 'cashier'), cashier_rows)
+
+
+def record_sale_rollups(record, items):
+    """Add one sale to the rollups in the current transaction (caller commits)"""
+    record_sales_rollups([(record, items)])
+
+
+def record_sales_rollups(sales):
+    """Add several (record, items) sales with one upsert per rollup table (caller commits)"""
+    product_rows, cashier_rows = _new_rollup_rows(), _new_rollup_rows()
+    for record, items in sales:
+        _accumulate(product_rows, cashier_rows, record, items)
+    _flush(product_rows, cashier_rows)
+
+
+def rebuild_sales_rollups():
+    """Recompute all rollups from billing records (caller commits); returns records processed"""
+    db.session.execute(delete(SalesRollupProduct))
+    db.session.execute(delete(SalesRollupCashier))
+
+    count = 0
+    stmt = select(*billing_record_columns()).order_by(BillingRecord.id).execution_options(yield_per=REBUILD_BATCH_SIZE)
+    for records in db.session.execute(stmt).partitions():
+        product_rows, cashier_rows = _new_rollup_rows(), _new_rollup_rows()
+        items_by_record = load_billing_items([record.id for record in records])
+        for record in records:
+            items = [item._asdict() for item in items_by_record[record.id]]
+            _accumulate(product_rows, cashier_rows, record, items)
+        _flush(product_rows, cashier_rows)
+        count += len(records)
+    return count
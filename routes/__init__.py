@@ -2,3 +2,7 @@ from .auth import auth_bp
 from .inventory import inventory_bp
 from .billing import billing_bp
 from .main_routes import main_bp
+from .reports import reports_bp
+from .metrics import metrics_bp
+from .debug import debug_bp
+from .stream import stream_bp
@@ -1,7 +1,9 @@
 from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for, current_app
+from sqlalchemy.exc import SQLAlchemyError
 from extensions import db
 from models import User
-from utils import hash_password, verify_password, owner_required, login_required
+from utils import hash_password, verify_password, password_needs_rehash, owner_required, login_required
+from login_guard import hash_pool, login_throttle, HashPoolBusy
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -13,9 +15,32 @@ def login():
         username = data.get('username', '').lower()
         password = data.get('password', '')
         
+        # Throttled usernames are rejected before any hashing work
+        retry_after = login_throttle.retry_after(username)
+        if retry_after:
+            return _login_error('Too many failed attempts, please try again later', 429, retry_after)
+        
         user = User.query.filter_by(username=username).first()
         
-        if user and verify_password(user.password, password):
+        try:
+            valid = user is not None and hash_pool.run(verify_password, user.password, password)
+        except HashPoolBusy:
+            return _login_error('Server is busy, please try again', 503, 1)
+        
+        if valid and password_needs_rehash(user.password):
+            try:
+                user.password = hash_pool.run(hash_password, password)
+                db.session.commit()
+            except HashPoolBusy:
+                # Best effort: the hash is upgraded on a later login instead
+                current_app.logger.info('Hash pool busy, password rehash for %s postponed', username)
+            except SQLAlchemyError:
+                # Neither is a failed write a reason to refuse a valid password
+                db.session.rollback()
+                current_app.logger.exception('Password rehash for %s could not be saved', username)
+        
+        if valid:
+            login_throttle.reset(username)
             session.permanent = True
             session['user'] = user.to_dict()
             
@@ -23,13 +48,19 @@ def login():
                 return jsonify({'success': True, 'redirect': url_for('main.home')}), 200
             return redirect(url_for('main.home'))
         
-        error = 'Invalid username or password'
-        if request.is_json:
-            return jsonify({'success': False, 'error': error}), 401
-        return render_template('login.html', error=error)
+        login_throttle.record_failure(username)
+        return _login_error('Invalid username or password', 401)
     
     return render_template('login.html')
 
+def _login_error(error, status, retry_after=None):
+    """Failed login response for JSON and form posts alike"""
+    headers = {'Retry-After': str(retry_after)} if retry_after else {}
+    if request.is_json:
+        return jsonify({'success': False, 'error': error}), status, headers
+    # Form posts keep the original behaviour of re-rendering the page
+    return render_template('login.html', error=error), 200 if status == 401 else status, headers
+
 @auth_bp.route('/logout')
 def logout():
     """Logout user"""
@@ -1,44 +1,173 @@
-from flask import Blueprint, render_template, request, jsonify, session, send_file
+from flask import Blueprint, render_template, request, jsonify, session, send_file, Response, stream_with_context, current_app
+from sqlalchemy import or_, and_, case, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
 from extensions import db
-from models import Product, BillingRecord, BillingItem
-from utils import cashier_required, get_user_permissions, generate_invoice_pdf
+from models import (Product, BillingRecord, BillingItem, IdempotencyKey, billing_record_columns,
+                    billing_record_dict, serialize_billing_records, find_products)
+from utils import (cashier_required, manager_required, get_user_permissions,
+                   encode_cursor, decode_cursor, parse_date_param)
+from invoice_cache import invoice_cache_key, render_invoice
+from invoice_export import iter_invoice_zip, ExportBusy
+from stats import adjust_dashboard_stats, is_low_stock, get_dashboard_stats
+from stock_events import publish_catalog_change
+from rollups import record_sale_rollups, record_sales_rollups
+from signals import emit_low_stock
+from idgen import next_billing_id
+from idempotency import (IDEMPOTENCY_HEADER, IdempotencyKeyMismatch, request_fingerprint, validate_key,
+                         find_completed, claim_key, complete, replay, load_keys, key_row, stored_body)
 from datetime import datetime
+from types import SimpleNamespace
 
 billing_bp = Blueprint('billing', __name__)
 
+# Invoices are immutable once rendered, so clients may keep them for a year
+INVOICE_MAX_AGE = 365 * 24 * 3600
+
+# Products rendered into the POS page before the cashier searches
+BILLING_PAGE_PRODUCTS = 60
+
+# Sales accepted per /api/billing/batch request
+BATCH_MAX_SALES = 200
+# Passes over a batch that lost a race for stock or a key to a concurrent checkout
+BATCH_ATTEMPTS = 3
+# Checkout body fields every batched sale must carry as numbers
+CHECKOUT_AMOUNT_FIELDS = ('subtotal', 'discountPercent', 'discountAmount', 'gstRate', 'gstAmount', 'total')
+# Batched sale fields that are not part of the checkout body
+BATCH_SALE_META = ('idempotencyKey', 'soldAt')
+
+# Billing history page size (default and hard cap)
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
+class StockConflict(Exception):
+    """A cart line could not be reserved: not enough stock, or it was sold concurrently"""
+
+def _lock_products(product_ids):
+    """Load the cart's products with one IN query, row-locked where supported"""
+    # FOR UPDATE is rendered on PostgreSQL and dropped on SQLite, where the
+    # conditional UPDATE in _reserve_stock() is what prevents overselling.
+    products = Product.query.filter(Product.id.in_(product_ids)).with_for_update().all()
+    return {p.id: p for p in products}
+
+def _reserve_stock(products, quantities):
+    """Atomically decrement stock for {product_id: quantity}.
+
+    Every row is decremented by a single UPDATE guarded by `stock >= quantity`,
+    so concurrent checkouts can never both take the last unit. Raises
+    StockConflict if any line cannot be satisfied; returns the change in the
+    number of low-stock products for the dashboard stats and the products
+    that dropped below their reorder level.
+    """
+    for product_id, quantity in quantities.items():
+        if products[product_id].stock < quantity:
+            raise StockConflict(f'Insufficient stock for {products[product_id].name}')
+    if not quantities:
+        return 0, []
+
+    quantity_for = case(quantities, value=Product.id)
+    rows = db.session.execute(
+        update(Product)
+        .where(Product.id.in_(list(quantities)), Product.stock >= quantity_for)
+        .values(stock=Product.stock - quantity_for)
+        .returning(Product.id, Product.stock, Product.reorder_level)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+    if len(rows) != len(quantities):
+        updated = {row.id for row in rows}
+        lost = next(pid for pid in quantities if pid not in updated)
+        raise StockConflict(f'Insufficient stock for {products[lost].name} (sold concurrently)')
+
+    low_stock_delta = 0
+    crossed = []
+    for row in rows:
+        was_low = is_low_stock(row.stock + quantities[row.id], row.reorder_level)
+        now_low = is_low_stock(row.stock, row.reorder_level)
+        low_stock_delta += int(now_low) - int(was_low)
+        if now_low and not was_low:
+            crossed.append(products[row.id])
+        # Keep the loaded instance in sync without issuing another UPDATE
+        set_committed_value(products[row.id], 'stock', row.stock)
+    return low_stock_delta, crossed
+
+def _cart_quantities(items):
+    """Total quantity per product id for a cart (ValueError on a bad line)"""
+    # Note: item['id'] is Product ID from frontend; a product may appear on several lines
+    quantities = {}
+    for item in items:
+        quantity = int(item['quantity'])
+        if quantity <= 0:
+            raise ValueError('Quantity must be positive')
+        product_id = int(item['id'])
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+def _billing_item_row(billing_id, product, item):
+    """Build a billing_items row for a cart line (product may be None if unknown)"""
+    return {
+        'billing_id': billing_id,
+        'product_id': int(item['id']),
+        'product_name': product.name if product else "Unknown Product",
+        'quantity': int(item['quantity']),
+        'price': product.price if product else 0,
+        'unit': product.unit if product else 'pc'
+    }
+
 @billing_bp.route('/billing')
 @cashier_required
 def billing_page():
     """Render billing & POS page"""
     permissions = get_user_permissions(session['user']['role'])
-    products = Product.query.all()
-    # History: newest first
-    history = BillingRecord.query.order_by(BillingRecord.timestamp.desc()).all()
+    # Only the first in-stock products are rendered; the page searches the
+    # rest via /api/products/search. History is fetched page by page from /api/billing.
+    products = find_products('', in_stock=True, limit=BILLING_PAGE_PRODUCTS)
+    stats = get_dashboard_stats()
     
     return render_template('billing.html', 
         user=session['user'],
         permissions=permissions,
-        products=[p.to_dict() for p in products],
-        billing_history=[h.to_dict() for h in history]
+        products=products,
+        transaction_count=stats.total_transactions
     )
 
 @billing_bp.route('/api/billing', methods=['POST'])
 @cashier_required
 def add_billing_record():
-    """Add a billing record"""
+    """Add a billing record.
+
+    An optional Idempotency-Key header makes retries safe: a repeated key
+    replays the stored response instead of recording the sale twice.
+    """
     data = request.json
+    username = session['user']['username']
+    idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+    fingerprint = None
     
     try:
-        # 1. Update stock
-        for item in data['items']:
-            product = Product.query.get(item['id'])
-            if product:
-                if product.stock < item['quantity']:
-                     return jsonify({'error': f'Insufficient stock for {product.name}'}), 400
-                product.stock -= item['quantity']
+        # 1. Reserve stock for the whole cart (one SELECT + one UPDATE)
+        quantities = _cart_quantities(data['items'])
+
+        idempotency_entry = None
+        if idempotency_key is not None:
+            idempotency_key = validate_key(idempotency_key)
+            fingerprint = request_fingerprint(data)
+            completed = find_completed(username, idempotency_key, fingerprint)
+            if completed is not None:
+                return replay(completed)
+            # Claimed before any work, so a concurrent retry of this sale
+            # waits on the key instead of selling twice
+            idempotency_entry = claim_key(username, idempotency_key, fingerprint)
+
+        products = _lock_products(list(quantities))
+        # Unknown products are recorded as-is without touching stock (original behaviour)
+        low_stock_delta, crossed = _reserve_stock(products, {
+            product_id: quantity for product_id, quantity in quantities.items() if product_id in products
+        })
         
         # 2. Create Billing Record
-        timestamp_id = int(datetime.now().timestamp() * 1000)
+        # Unique across workers and nodes, unlike the checkout millisecond
+        timestamp_id = next_billing_id()
         
         record = BillingRecord(
             timestamp_id=timestamp_id,
@@ -49,85 +178,354 @@ def add_billing_record():
             gst_rate=data['gstRate'],
             gst_amount=data['gstAmount'],
             total=data['total'],
-            created_by=session['user']['username']
+            created_by=username
         )
         db.session.add(record)
         db.session.flush() # Get ID
         
-        # 3. Create Items
-        billing_items_list = []
-        for item in data['items']:
-            # We fetch again or use the one from loop above. 
-            # Note: item['id'] is Product ID from frontend
-            # We need to snapshot name/price in case product changes later?
-            # Original code just stored what frontend sent or linked?
-            # Original: 'items': data['items'] stored directly.
-            # We should be robust.
-            
-            p = Product.query.get(item['id'])
-            p_name = p.name if p else "Unknown Product"
-            p_price = p.price if p else 0
-            
-            p_unit = p.unit if p else 'pc'
-            
-            b_item = BillingItem(
-                billing_id=record.id,
-                product_id=item['id'],
-                product_name=p_name,
-                quantity=item['quantity'],
-                price=p_price,
-                unit=p_unit
-            )
-            db.session.add(b_item)
-            # Reconstruct for response to match old format
-            billing_items_list.append({
-                'id': item['id'],
-                'name': p_name,
-                'category': p.category if p else '',
-                'stock': p.stock if p else 0,
-                'price': p_price,
-                'sku': p.sku if p else '',
-                'quantity': item['quantity']
-            })
+        # 3. Create Items, snapshotting name/price/unit in case the product changes later
+        item_rows = [
+            _billing_item_row(record.id, products.get(int(item['id'])), item)
+            for item in data['items']
+        ]
+        db.session.execute(insert(BillingItem), item_rows)
+
+        record_sale_rollups(record, item_rows)
+
+        adjust_dashboard_stats(low_stock=low_stock_delta, transactions=1, revenue=record.total)
+        if products:
+            # Stock changed: invalidate every worker's SKU cache and tell the terminals
+            publish_catalog_change(updated=products.values())
 
-        db.session.commit()
-        
         # Return format must match original exactly
-        response_record = record.to_dict()
-        # Override items with the full details frontend might expect if it renders them immediately
-        # The to_dict() returns a simplified item list. 
+        # Items are the full details frontend might expect if it renders them immediately
         # Check original: it returned 'items': data['items'] (which has full product details usually)
-        response_record['items'] = data['items'] # Echo back what was sent + ID updates if any
+        response_record = record.to_dict(items=data['items']) # Echo back what was sent + ID updates if any
         response_record['id'] = timestamp_id
+        if idempotency_entry is not None:
+            complete(idempotency_entry, record.id, 201, response_record)
+
+        db.session.commit()
+        emit_low_stock(current_app._get_current_object(), crossed)
         
         return jsonify(response_record), 201
         
+    except StockConflict as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 409
+    except IdempotencyKeyMismatch as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 422
+    except IntegrityError as e:
+        db.session.rollback()
+        if fingerprint is not None:
+            # Lost the race for the key: the other request has committed
+            try:
+                completed = find_completed(username, idempotency_key, fingerprint)
+            except IdempotencyKeyMismatch as mismatch:
+                return jsonify({'error': str(mismatch)}), 422
+            if completed is not None:
+                return replay(completed)
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 400
 
+def _parse_sold_at(value):
+    """When an offline sale happened (local time like datetime.now()); never in the future"""
+    now = datetime.now()
+    if value is None:
+        return now
+    sold_at = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if sold_at.tzinfo is not None:
+        sold_at = sold_at.astimezone().replace(tzinfo=None)
+    return min(sold_at, now)
+
+def _batch_result(key, status, record=None, error=None, replayed=False):
+    result = {'idempotencyKey': key, 'status': status}
+    if record is not None:
+        result['record'] = record
+    if error is not None:
+        result['error'] = error
+    if replayed:
+        result['replayed'] = True
+    return result
+
+def _apply_sales_batch(username, sales):
+    """Record every valid sale of a batch in the current transaction (caller commits).
+
+    Returns (results, sales recorded, products that crossed their reorder level).
+    Raises StockConflict / IntegrityError when a concurrent checkout won a
+    race; the caller rolls back and runs the batch again.
+    """
+    results = [None] * len(sales)
+    pending = []     # (index, key, fingerprint, checkout body, quantities, sold_at)
+    duplicates = []  # (index, key, fingerprint) of keys repeated within the batch
+    first_for_key = {}
+
+    # 1. Validate every sale without touching the database
+    for index, sale in enumerate(sales):
+        key = sale.get('idempotencyKey') if isinstance(sale, dict) else None
+        try:
+            key = validate_key(key)
+            checkout = {field: value for field, value in sale.items() if field not in BATCH_SALE_META}
+            quantities = _cart_quantities(checkout['items'])
+            for field in CHECKOUT_AMOUNT_FIELDS:
+                float(checkout[field])
+            sold_at = _parse_sold_at(sale.get('soldAt'))
+        except KeyError as e:
+            results[index] = _batch_result(key, 400, error=f'Missing field {e}')
+            continue
+        except (TypeError, ValueError, AttributeError) as e:
+            results[index] = _batch_result(key, 400, error=str(e))
+            continue
+        fingerprint = request_fingerprint(checkout)
+        if key in first_for_key:
+            duplicates.append((index, key, fingerprint))
+            continue
+        first_for_key[key] = (index, fingerprint)
+        pending.append((index, key, fingerprint, checkout, quantities, sold_at))
+
+    # 2. Sales already recorded (one query for every key) are replayed
+    existing = load_keys(username, [sale[1] for sale in pending])
+    new_sales = []
+    for sale in pending:
+        index, key, fingerprint = sale[:3]
+        entry = existing.get(key)
+        if entry is None:
+            new_sales.append(sale)
+        elif entry.request_hash != fingerprint:
+            results[index] = _batch_result(key, 422, error=f'{IDEMPOTENCY_HEADER} was already used for a different request')
+        else:
+            results[index] = _batch_result(key, entry.status_code, record=stored_body(entry), replayed=True)
+
+    # 3. One locked fetch of every product, then reserve stock sale by sale in memory
+    product_ids = {product_id for sale in new_sales for product_id in sale[4]}
+    products = _lock_products(list(product_ids)) if product_ids else {}
+    available = {product_id: product.stock for product_id, product in products.items()}
+    accepted = []
+    totals = {}
+    for sale in new_sales:
+        index, key, _fingerprint, _checkout, quantities, _sold_at = sale
+        # Unknown products are recorded as-is without touching stock (like single checkouts)
+        wanted = {product_id: quantity for product_id, quantity in quantities.items() if product_id in products}
+        short = next((product_id for product_id, quantity in wanted.items() if available[product_id] < quantity), None)
+        if short is not None:
+            results[index] = _batch_result(key, 409, error=f'Insufficient stock for {products[short].name}')
+            continue
+        for product_id, quantity in wanted.items():
+            available[product_id] -= quantity
+            totals[product_id] = totals.get(product_id, 0) + quantity
+        accepted.append(sale)
+
+    crossed = []
+    if accepted:
+        # 4. Grouped stock update: one guarded UPDATE for the whole batch
+        low_stock_delta, crossed = _reserve_stock(products, totals)
+
+        # 5. Records, their items and the rollups. The records go in with one
+        # executemany and their ids come back with one SELECT by timestamp_id:
+        # an ordered multi-row INSERT ... RETURNING is not batched on SQLite.
+        record_rows = [
+            {
+                'timestamp_id': next_billing_id(),
+                'timestamp': sold_at,
+                'subtotal': checkout['subtotal'],
+                'discount_percent': checkout['discountPercent'],
+                'discount_amount': checkout['discountAmount'],
+                'gst_rate': checkout['gstRate'],
+                'gst_amount': checkout['gstAmount'],
+                'total': checkout['total'],
+                'created_by': username
+            }
+            for _index, _key, _fingerprint, checkout, _quantities, sold_at in accepted
+        ]
+        db.session.execute(insert(BillingRecord), record_rows)
+        ids = dict(db.session.execute(
+            select(BillingRecord.timestamp_id, BillingRecord.id)
+            .where(BillingRecord.timestamp_id.in_([row['timestamp_id'] for row in record_rows]))
+        ).all())
+        records = [SimpleNamespace(id=ids[row['timestamp_id']], **row) for row in record_rows]
+
+        item_rows = []
+        rollup_sales = []
+        for record, sale in zip(records, accepted):
+            rows = [_billing_item_row(record.id, products.get(int(item['id'])), item) for item in sale[3]['items']]
+            item_rows.extend(rows)
+            rollup_sales.append((record, rows))
+        db.session.execute(insert(BillingItem), item_rows)
+        record_sales_rollups(rollup_sales)
+
+        adjust_dashboard_stats(low_stock=low_stock_delta, transactions=len(records),
+                               revenue=sum(record.total for record in records))
+        if totals:
+            publish_catalog_change(updated=[products[product_id] for product_id in totals])
+
+        # 6. Keys with the stored responses, committed with the sales
+        key_rows = []
+        for record, (index, key, fingerprint, checkout, _quantities, _sold_at) in zip(records, accepted):
+            response_record = billing_record_dict(record, checkout['items'])
+            key_rows.append(key_row(username, key, fingerprint, record.id, 201, response_record))
+            results[index] = _batch_result(key, 201, record=response_record)
+        db.session.execute(insert(IdempotencyKey), key_rows)
+
+    # A key repeated within the batch gets its first sale's result
+    for index, key, fingerprint in duplicates:
+        first_index, first_fingerprint = first_for_key[key]
+        if fingerprint != first_fingerprint:
+            results[index] = _batch_result(key, 422, error=f'{IDEMPOTENCY_HEADER} was already used for a different request')
+        else:
+            first = results[first_index]
+            results[index] = dict(first, replayed=True) if first['status'] == 201 else dict(first)
+
+    return results, len(accepted), crossed
+
+@billing_bp.route('/api/billing/batch', methods=['POST'])
+@cashier_required
+def add_billing_batch():
+    """Record sales queued by an offline POS terminal, many per transaction.
+
+    Body: {"sales": [...]}, each sale a checkout body plus its own
+    "idempotencyKey" and optionally "soldAt" (ISO time of the sale).
+    Returns one result per sale, in order: 201 recorded (or replayed, for a
+    key seen before), 400/422 invalid, 409 not enough stock. Only valid
+    sales are recorded; the client drops every sale that got a result.
+    """
+    data = request.get_json(silent=True) or {}
+    sales = data.get('sales')
+    if not isinstance(sales, list) or not sales:
+        return jsonify({'error': 'sales must be a non-empty list'}), 400
+    if len(sales) > BATCH_MAX_SALES:
+        return jsonify({'error': f'At most {BATCH_MAX_SALES} sales per batch'}), 400
+    username = session['user']['username']
+
+    for attempt in range(BATCH_ATTEMPTS):
+        try:
+            results, recorded, crossed = _apply_sales_batch(username, sales)
+            db.session.commit()
+        except (StockConflict, IntegrityError):
+            # A concurrent checkout took stock or one of the keys: start over,
+            # the next pass sees its committed rows
+            db.session.rollback()
+            continue
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        emit_low_stock(current_app._get_current_object(), crossed)
+        return jsonify({'results': results, 'recorded': recorded}), 200
+
+    return jsonify({'error': 'Batch conflicted with concurrent checkouts, retry'}), 409
+
 @billing_bp.route('/api/billing', methods=['GET'])
 @cashier_required
 def get_billing_history():
-    """Get billing history"""
-    history = BillingRecord.query.order_by(BillingRecord.timestamp.desc()).all()
-    return jsonify([h.to_dict() for h in history])
+    """Get billing history, newest first, one keyset page at a time.
+
+    Query params: limit, cursor (from a previous page's nextCursor),
+    start / end (YYYY-MM-DD or ISO datetime, end inclusive for bare dates)
+    and cashier (created_by username).
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+        start = parse_date_param(request.args.get('start'))
+        end = parse_date_param(request.args.get('end'), end=True)
+        cursor = request.args.get('cursor')
+        if cursor:
+            cursor_ts, cursor_id = decode_cursor(cursor)
+            cursor_ts = datetime.fromisoformat(cursor_ts)
+            cursor_id = int(cursor_id)
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid pagination or filter parameters'}), 400
+
+    query = BillingRecord.query.with_entities(*billing_record_columns())
+    cashier = request.args.get('cashier')
+    if cashier:
+        query = query.filter(BillingRecord.created_by == cashier.lower())
+    if start:
+        query = query.filter(BillingRecord.timestamp >= start)
+    if end:
+        query = query.filter(BillingRecord.timestamp < end)
+    if cursor:
+        # Resume strictly after the last row of the previous page
+        query = query.filter(or_(
+            BillingRecord.timestamp < cursor_ts,
+            and_(BillingRecord.timestamp == cursor_ts, BillingRecord.id < cursor_id)
+        ))
+
+    # Fetch one extra row to know whether another page exists
+    records = query.order_by(BillingRecord.timestamp.desc(), BillingRecord.id.desc()).limit(limit + 1).all()
+    has_more = len(records) > limit
+    records = records[:limit]
+
+    next_cursor = None
+    if has_more:
+        last = records[-1]
+        next_cursor = encode_cursor(last.timestamp.isoformat(), last.id)
+
+    return jsonify({
+        'records': serialize_billing_records(records),
+        'nextCursor': next_cursor
+    })
 
 @billing_bp.route('/api/billing/invoice/<int:record_id>', methods=['GET'])
 @cashier_required
 def download_invoice(record_id):
-    """Generate and download invoice PDF"""
+    """Download an invoice PDF, rendered once and then served from the cache"""
     # record_id here is actually the timestamp_id passed from frontend
+    etag = invoice_cache_key(record_id)
+    if etag in request.if_none_match:
+        # Records never change, so a matching ETag needs no DB or disk access
+        response = Response(status=304)
+        response.set_etag(etag)
+        _set_invoice_cache_headers(response)
+        return response
+
     record = BillingRecord.query.filter_by(timestamp_id=record_id).first_or_404()
     # Items are linked by the DB primary key, not timestamp_id
     items = BillingItem.query.filter_by(billing_id=record.id).all()
     
-    pdf_buffer = generate_invoice_pdf(record, items)
+    pdf_path = render_invoice(record, items)
     
-    return send_file(
-        pdf_buffer,
+    response = send_file(
+        pdf_path,
         as_attachment=True,
         download_name=f'invoice_{record_id}.pdf',
-        mimetype='application/pdf'
+        mimetype='application/pdf',
+        etag=etag,
+        max_age=INVOICE_MAX_AGE
     )
+    _set_invoice_cache_headers(response)
+    return response
+
+def _set_invoice_cache_headers(response):
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.max_age = INVOICE_MAX_AGE
+    response.cache_control.immutable = True
+
+@billing_bp.route('/api/billing/invoices.zip', methods=['GET'])
+@manager_required
+def export_invoices():
+    """Download every invoice in a date range (?start=&end=, end inclusive) as a ZIP"""
+    try:
+        start = parse_date_param(request.args.get('start'))
+        end = parse_date_param(request.args.get('end'), end=True)
+    except ValueError:
+        return jsonify({'error': 'Invalid date range'}), 400
+    if not start or not end:
+        return jsonify({'error': 'Both start and end are required'}), 400
 
+    try:
+        chunks = iter_invoice_zip(start, end)
+    except ExportBusy:
+        return jsonify({'error': 'Another invoice export is running, please try again shortly'}), 503, {'Retry-After': '30'}
+
+    filename = f"invoices_{request.args['start']}_{request.args['end']}.zip"
+    response = Response(
+        stream_with_context(chunks),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+    # Frees the export slot even if the download is dropped before it starts
+    response.call_on_close(chunks.close)
+    return response
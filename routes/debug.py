@@ -0,0 +1,21 @@
+from flask import Blueprint, request, jsonify, current_app
+from utils import owner_required
+
+debug_bp = Blueprint('debug', __name__)
+
+@debug_bp.route('/debug/sql-profile', methods=['GET'])
+@owner_required
+def sql_profile():
+    """Recent per-request SQL profiles of this worker, newest first (?flagged=1 for problems only)"""
+    profiler = current_app.extensions['sql_profiler']
+    reports = list(reversed(profiler.history))
+    if request.args.get('flagged') in ('1', 'true'):
+        reports = [report for report in reports if report['flagged']]
+    return jsonify({
+        'thresholds': {
+            'nPlusOne': profiler.n_plus_one,
+            'slowMs': profiler.slow_ms,
+            'maxStatements': profiler.max_statements
+        },
+        'reports': reports
+    })
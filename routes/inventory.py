@@ -1,23 +1,62 @@
-from flask import Blueprint, render_template, request, jsonify, session
+from flask import Blueprint, render_template, request, jsonify, session, Response, stream_with_context, current_app
+from sqlalchemy import select, update, case, and_, true, exists, func, null
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 from extensions import db
-from models import Product
-from utils import cashier_required, manager_required, owner_required, get_user_permissions
+from models import (Product, ProductTombstone, PRODUCT_FIELDS, LOW_STOCK_THRESHOLD, product_dict, product_columns,
+                    find_products, low_stock_condition)
+from utils import (cashier_required, manager_required, owner_required, get_user_permissions, dialect_insert,
+                   encode_cursor, decode_cursor)
+from stats import adjust_dashboard_stats, rebuild_dashboard_stats, is_low_stock, get_dashboard_stats
+from catalog_cache import product_lookup_cache, get_catalog_version
+from stock_events import publish_catalog_change
+from signals import emit_low_stock
+from pricing import parse_reprice_rule, reprice_expression
 from datetime import datetime
+import codecs
+import csv
+import io
+import json
 
 inventory_bp = Blueprint('inventory', __name__)
 
+# Rows fetched per round trip (and per streamed chunk) during export
+EXPORT_CHUNK_SIZE = 500
+
+# Product search result limit (default and hard cap)
+SEARCH_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+# Rows rendered into the inventory page; the rest is reached through search
+INVENTORY_PAGE_PRODUCTS = 100
+
+# Low-stock listing page size (default and hard cap)
+LOW_STOCK_PAGE_SIZE = 50
+LOW_STOCK_MAX_PAGE_SIZE = 200
+
+# Upper bound for the ?chunk_size= of an import
+IMPORT_MAX_CHUNK_SIZE = 5000
+
+# Bulk PATCH: products per request, and per UPDATE statement
+BULK_PATCH_MAX_PRODUCTS = 1000
+BULK_UPDATE_CHUNK_SIZE = 500
+
+# Columns written by an upsert import (id is always assigned by the DB)
+IMPORT_COLUMNS = ('name', 'category', 'stock', 'price', 'sku', 'unit', 'reorder_level')
+
 @inventory_bp.route('/inventory')
 @cashier_required
 def inventory_page():
     """Render inventory management page"""
     permissions = get_user_permissions(session['user']['role'])
     can_edit = permissions['edit_inventory']
-    products = Product.query.order_by(Product.id).all()
+    # Only the first rows are rendered; the page searches the rest via /api/products/search
+    products = Product.query.order_by(Product.id).limit(INVENTORY_PAGE_PRODUCTS).all()
     
     return render_template('inventory.html', 
         user=session['user'],
         permissions=permissions,
         products=[p.to_dict() for p in products],
+        total_products=get_dashboard_stats().total_products,
         can_edit=can_edit,
         show_add_form=False
     )
@@ -25,9 +64,105 @@ def inventory_page():
 @inventory_bp.route('/api/products', methods=['GET'])
 @cashier_required
 def get_products():
-    """Get all products"""
-    products = Product.query.all()
-    return jsonify([p.to_dict() for p in products])
+    """Get all products, or with ?since=<version> only what changed after that catalog version.
+
+    The catalog version is sent as the ETag (and X-Catalog-Version); a
+    request whose If-None-Match still matches gets 304 Not Modified. The
+    delta answers {version, full, products, deleted}: changed products and
+    the ids of deleted ones (from tombstones), or the whole catalog with
+    full=true when `since` is unknown to this database.
+    """
+    # Read the version first: rows read afterwards are at least that new
+    version = get_catalog_version()
+    etag = f'catalog-{version}'
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        since = request.args.get('since')
+        if since is None:
+            products = db.session.execute(select(*product_columns())).all()
+            response = jsonify([product_dict(row) for row in products])
+        else:
+            try:
+                since = int(since)
+            except ValueError:
+                return jsonify({'error': 'Invalid since version'}), 400
+            response = jsonify(_catalog_delta(since, version))
+    response.set_etag(etag)
+    response.headers['X-Catalog-Version'] = str(version)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _catalog_delta(since, version):
+    """Products changed and deleted after catalog version `since`"""
+    full = since <= 0 or since > version  # Never synced, or a different / restored database
+    stmt = select(*product_columns())
+    if not full:
+        stmt = stmt.where(Product.version > since)
+    products = [product_dict(row) for row in db.session.execute(stmt)]
+
+    deleted = []
+    if not full:
+        # A tombstoned id that exists again (SQLite may reuse ids) is not deleted
+        deleted = db.session.execute(
+            select(ProductTombstone.product_id)
+            .where(ProductTombstone.version > since,
+                   ~exists().where(Product.id == ProductTombstone.product_id))
+        ).scalars().all()
+    return {'version': version, 'full': full, 'products': products, 'deleted': deleted}
+
+@inventory_bp.route('/api/products/low-stock', methods=['GET'])
+@cashier_required
+def low_stock_products():
+    """Products below their own reorder level, by id, one keyset page at a time.
+
+    Query params: limit, cursor (from a previous page's nextCursor). Served
+    from the ix_products_low_stock partial index.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', LOW_STOCK_PAGE_SIZE)), 1), LOW_STOCK_MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor')
+        after_id = int(decode_cursor(cursor)[0]) if cursor else None
+    except (ValueError, TypeError, IndexError):
+        return jsonify({'error': 'Invalid pagination parameters'}), 400
+
+    stmt = select(*product_columns()).where(low_stock_condition())
+    if after_id is not None:
+        stmt = stmt.where(Product.id > after_id)
+    # Fetch one extra row to know whether another page exists
+    rows = db.session.execute(stmt.order_by(Product.id).limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    return jsonify({
+        'products': [product_dict(row) for row in rows],
+        'nextCursor': encode_cursor(rows[-1].id) if has_more else None
+    })
+
+@inventory_bp.route('/api/products/search', methods=['GET'])
+@cashier_required
+def search_products():
+    """Ranked product search on name, SKU and category (?q=, ?category=, ?in_stock=1, ?limit=)"""
+    try:
+        limit = min(max(int(request.args.get('limit', SEARCH_LIMIT)), 1), SEARCH_MAX_LIMIT)
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+
+    return jsonify(find_products(
+        request.args.get('q', ''),
+        category=request.args.get('category'),
+        in_stock=request.args.get('in_stock') in ('1', 'true'),
+        limit=limit
+    ))
+
+@inventory_bp.route('/api/products/sku/<path:sku>', methods=['GET'])
+@cashier_required
+def lookup_product_by_sku(sku):
+    """Barcode scan lookup, served from the per-worker SKU cache"""
+    product = product_lookup_cache.lookup(sku)
+    if product is None:
+        return jsonify({'error': 'Product not found'}), 404
+    return jsonify(product)
 
 @inventory_bp.route('/api/product', methods=['POST'])
 @manager_required
@@ -47,9 +182,13 @@ def add_product():
 
             price=float(data['price']),
             sku=data['sku'],
-            unit=data.get('unit', 'pc')
+            unit=data.get('unit', 'pc'),
+            reorder_level=int(data.get('reorder_level', LOW_STOCK_THRESHOLD))
         )
         db.session.add(new_product)
+        db.session.flush()
+        adjust_dashboard_stats(products=1, low_stock=int(is_low_stock(new_product.stock, new_product.reorder_level)))
+        publish_catalog_change(updated=[new_product])
         db.session.commit()
         return jsonify(new_product.to_dict()), 201
     except Exception as e:
@@ -72,14 +211,22 @@ def update_product(product_id):
          if Product.query.filter_by(sku=new_sku).first():
             return jsonify({'error': 'SKU already exists'}), 400
 
+    was_low = is_low_stock(product.stock, product.reorder_level)
+
     product.name = data.get('name', product.name)
     product.category = data.get('category', product.category)
     product.stock = int(data.get('stock', product.stock))
     product.price = float(data.get('price', product.price))
     product.sku = new_sku
     product.unit = data.get('unit', product.unit)
+    product.reorder_level = int(data.get('reorder_level', product.reorder_level))
     
+    now_low = is_low_stock(product.stock, product.reorder_level)
+    adjust_dashboard_stats(low_stock=int(now_low) - int(was_low))
+    publish_catalog_change(updated=[product])
     db.session.commit()
+    if now_low and not was_low:
+        emit_low_stock(current_app._get_current_object(), [product])
     return jsonify(product.to_dict())
 
 @inventory_bp.route('/api/product/<int:product_id>', methods=['DELETE'])
@@ -88,14 +235,216 @@ def delete_product(product_id):
     """Delete a product"""
     product = Product.query.get(product_id)
     if product:
+        adjust_dashboard_stats(products=-1, low_stock=-int(is_low_stock(product.stock, product.reorder_level)))
         db.session.delete(product)
+        publish_catalog_change(deleted=[product_id])
         db.session.commit()
     return jsonify({'success': True})
 
+def _optional_text(value):
+    return None if value is None else str(value)
+
+def _required_text(value):
+    text = str(value if value is not None else '').strip()
+    if not text:
+        raise ValueError('must not be empty')
+    return text
+
+# Fields a bulk PATCH may change, with their parsers
+BULK_PATCH_FIELDS = {
+    'name': _required_text,
+    'category': _optional_text,
+    'stock': int,
+    'price': float,
+    'sku': _required_text,
+    'unit': _required_text,
+    'reorder_level': int,
+}
+
+def _parse_bulk_changes(items):
+    """{product_id: {field: value}} from a bulk PATCH body; raises ValueError"""
+    changes = {}
+    for item in items:
+        if not isinstance(item, dict) or 'id' not in item:
+            raise ValueError('Every product needs an id')
+        try:
+            product_id = int(item['id'])
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid product id {item['id']!r}")
+        if product_id in changes:
+            raise ValueError(f'Product {product_id} is listed twice')
+        fields = {}
+        for field, value in item.items():
+            if field == 'id':
+                continue
+            if field not in BULK_PATCH_FIELDS:
+                raise ValueError(f'Unknown field {field}')
+            try:
+                fields[field] = BULK_PATCH_FIELDS[field](value)
+            except (TypeError, ValueError):
+                raise ValueError(f'Invalid {field} for product {product_id}')
+        if not fields:
+            raise ValueError(f'Nothing to update for product {product_id}')
+        changes[product_id] = fields
+    return changes
+
+@inventory_bp.route('/api/products', methods=['PATCH'])
+@manager_required
+def bulk_update_products():
+    """Update many products in one transaction: {"products": [{"id": 1, "price": 9.5}, ...]}.
+
+    Every changed field is a CASE on the product id, so each chunk of
+    BULK_UPDATE_CHUNK_SIZE products is one UPDATE. SKU conflicts are checked
+    with one query up front. Returns {updated, missing, version}.
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('products')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'products must be a non-empty list'}), 400
+    if len(items) > BULK_PATCH_MAX_PRODUCTS:
+        return jsonify({'error': f'At most {BULK_PATCH_MAX_PRODUCTS} products per request'}), 400
+    try:
+        changes = _parse_bulk_changes(items)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        before = {
+            row.id: row for row in db.session.execute(
+                select(Product.id, Product.stock, Product.reorder_level).where(Product.id.in_(list(changes)))
+            )
+        }
+        missing = [product_id for product_id in changes if product_id not in before]
+        present = [product_id for product_id in changes if product_id in before]
+
+        new_skus = {}
+        for product_id in present:
+            sku = changes[product_id].get('sku')
+            if sku is not None:
+                if sku in new_skus:
+                    return jsonify({'error': f'SKU {sku} is given to two products'}), 400
+                new_skus[sku] = product_id
+        if new_skus:
+            taken = db.session.execute(
+                select(Product.id, Product.sku).where(Product.sku.in_(list(new_skus)))
+            ).all()
+            conflict = next((row.sku for row in taken if row.id != new_skus[row.sku]), None)
+            if conflict is not None:
+                return jsonify({'error': f'SKU already exists: {conflict}'}), 409
+
+        rows = []
+        for start in range(0, len(present), BULK_UPDATE_CHUNK_SIZE):
+            chunk = present[start:start + BULK_UPDATE_CHUNK_SIZE]
+            values = {}
+            for field in BULK_PATCH_FIELDS:
+                new_values = {product_id: changes[product_id][field]
+                              for product_id in chunk if field in changes[product_id]}
+                if new_values:
+                    values[field] = case(new_values, value=Product.id, else_=getattr(Product, field))
+            rows += db.session.execute(
+                update(Product).where(Product.id.in_(chunk)).values(values)
+                .returning(*product_columns())
+                .execution_options(synchronize_session=False)
+            ).all()
+
+        was_low = {product_id for product_id, row in before.items() if is_low_stock(row.stock, row.reorder_level)}
+        now_low = {row.id for row in rows if is_low_stock(row.stock, row.reorder_level)}
+        adjust_dashboard_stats(low_stock=len(now_low) - len(was_low))
+        crossed = [row for row in rows if row.id in now_low and row.id not in was_low]
+        version = publish_catalog_change(updated=rows) if rows else None
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e.orig if hasattr(e, 'orig') else e)}), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+
+    emit_low_stock(current_app._get_current_object(), crossed)
+    return jsonify({'updated': len(rows), 'missing': missing, 'version': version})
+
+def _reprice_target(data):
+    """WHERE clause for the products a reprice request selects; raises ValueError"""
+    conditions = []
+    if data.get('category') is not None:
+        conditions.append(Product.category == str(data['category']))
+    if data.get('skus') is not None:
+        skus = data['skus']
+        if not isinstance(skus, list) or not skus:
+            raise ValueError('skus must be a non-empty list')
+        conditions.append(Product.sku.in_([str(sku) for sku in skus]))
+    if not conditions and data.get('all') is not True:
+        raise ValueError('Give a category, a skus list or "all": true')
+    return and_(true(), *conditions)
+
+def _price_summary(count, low, high, average):
+    if not count:
+        return None
+    return {'min': low, 'max': high, 'avg': round(average, 2)}
+
+@inventory_bp.route('/api/products/reprice', methods=['POST'])
+@manager_required
+def reprice_products():
+    """Reprice a category and/or SKU list with one set-based UPDATE (rules in pricing.py).
+
+    Body: category / skus / all, one of percent, amount or price, and
+    optionally step, ending, rounding (nearest, up, down), minPrice and
+    dryRun. Returns how many products matched and changed, with the price
+    range before and after.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        target = _reprice_target(data)
+        new_price = reprice_expression(parse_reprice_rule(data))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    dry_run = bool(data.get('dryRun'))
+    changed = Product.price != new_price
+
+    try:
+        # The summary (and a dry run) comes from one aggregate over the same expression
+        stats = db.session.execute(
+            select(
+                func.count(), func.count(case((changed, 1))),
+                func.min(Product.price), func.max(Product.price), func.avg(Product.price),
+                func.min(new_price), func.max(new_price), func.avg(new_price)
+            ).where(target)
+        ).one()
+        summary = {
+            'matched': stats[0],
+            'updated': stats[1],
+            'dryRun': dry_run,
+            'version': None,
+            'priceBefore': _price_summary(stats[0], *stats[2:5]),
+            'priceAfter': _price_summary(stats[0], *stats[5:8]),
+        }
+        if dry_run or not stats[1]:
+            db.session.rollback()
+            return jsonify(summary)
+
+        rows = db.session.execute(
+            update(Product).where(target, changed).values(price=new_price)
+            .returning(*product_columns())
+            .execution_options(synchronize_session=False)
+        ).all()
+        summary['updated'] = len(rows)
+        summary['version'] = publish_catalog_change(updated=rows)
+        db.session.commit()
+        return jsonify(summary)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+
 @inventory_bp.route('/api/export', methods=['GET'])
 @owner_required
 def export_inventory():
-    """Export inventory as JSON"""
+    """Export inventory as JSON (default), or streamed NDJSON / CSV via ?format="""
+    export_format = request.args.get('format', 'json').lower()
+    if export_format in ('ndjson', 'csv'):
+        return _stream_export(export_format)
+    if export_format != 'json':
+        return jsonify({'error': 'Unsupported export format'}), 400
+
     products = Product.query.all()
     return jsonify({
         'exportDate': datetime.now().isoformat(),
@@ -103,10 +452,62 @@ def export_inventory():
         'products': [p.to_dict() for p in products]
     })
 
+def _iter_product_chunks():
+    """Yield lists of product rows, fetched EXPORT_CHUNK_SIZE at a time"""
+    # yield_per streams from a server-side cursor on PostgreSQL instead of
+    # materialising the whole catalog
+    stmt = select(*product_columns()).order_by(Product.id).execution_options(yield_per=EXPORT_CHUNK_SIZE)
+    yield from db.session.execute(stmt).partitions()
+
+def _stream_export(export_format):
+    """Stream the catalog as NDJSON or CSV with chunked transfer encoding"""
+    def generate_ndjson():
+        for rows in _iter_product_chunks():
+            yield ''.join(json.dumps(product_dict(row)) + '\n' for row in rows)
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(PRODUCT_FIELDS)
+        for rows in _iter_product_chunks():
+            writer.writerows(tuple(row) for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # Header only, for an empty catalog
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    if export_format == 'ndjson':
+        body, mimetype = generate_ndjson(), 'application/x-ndjson'
+    else:
+        body, mimetype = generate_csv(), 'text/csv'
+
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=inventory_export_{timestamp}.{export_format}'}
+    )
+
 @inventory_bp.route('/api/import', methods=['POST'])
 @owner_required
 def import_inventory():
-    """Import inventory from JSON"""
+    """Import inventory from JSON, NDJSON or CSV.
+
+    ?mode=replace (default for JSON) wipes the catalog first; ?mode=upsert
+    (default for NDJSON / CSV) inserts or updates products by SKU, changing
+    only the fields a row gives.
+    Anything other than a legacy JSON replace goes through the chunked path.
+    """
+    content_type = request.mimetype
+    is_json = content_type == 'application/json'
+    mode = request.args.get('mode', 'replace' if is_json else 'upsert')
+    if mode not in ('replace', 'upsert'):
+        return jsonify({'error': 'Invalid import mode'}), 400
+    if not is_json or mode == 'upsert':
+        return _chunked_import(content_type, mode)
+
     data = request.json
     
     if not data.get('products') or not isinstance(data['products'], list):
@@ -117,7 +518,8 @@ def import_inventory():
     # We will replicate this destructively for compatibility, but safer is a Transaction.
     
     try:
-        # Clear existing
+        # Clear existing (remembering the ids for delta syncs)
+        removed_ids = db.session.execute(select(Product.id)).scalars().all()
         Product.query.delete()
         
         count = 0
@@ -133,13 +535,206 @@ def import_inventory():
                  stock=p_data['stock'],
                  price=p_data['price'],
                  sku=p_data['sku'],
-                 unit=p_data.get('unit', 'pc')
+                 unit=p_data.get('unit', 'pc'),
+                 reorder_level=p_data.get('reorder_level', LOW_STOCK_THRESHOLD)
              )
              db.session.add(p)
              count += 1
         
+        # The whole catalog was replaced, so recount rather than apply deltas
+        rebuild_dashboard_stats()
+        publish_catalog_change(deleted=removed_ids, reset=True)
         db.session.commit()
         return jsonify({'success': True, 'imported': count})
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
+
+def _iter_import_rows(content_type):
+    """Yield (line_number, dict_or_error) from the request body.
+
+    NDJSON and CSV are read line by line from the request stream; JSON has
+    to be parsed whole (no incremental parser available).
+    """
+    if content_type == 'application/json':
+        data = request.get_json(silent=True) or {}
+        products = data.get('products') if isinstance(data, dict) else data
+        if not isinstance(products, list):
+            raise ValueError('Invalid inventory data format')
+        for index, row in enumerate(products, start=1):
+            yield index, row
+        return
+
+    # Decode line by line: gunicorn's request body is not an io object, so
+    # it can't be wrapped in io.TextIOWrapper
+    stream = codecs.iterdecode(request.stream, 'utf-8')
+    if content_type in ('application/x-ndjson', 'application/ndjson'):
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError:
+                yield line_number, 'Invalid JSON'
+    elif content_type in ('text/csv', 'application/csv'):
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        raise ValueError('Unsupported import content type')
+
+def _clean_import_row(row):
+    """Validate one imported product.
+
+    Returns (values, given): values has every import column, missing ones
+    filled with the defaults a new product gets; given are the columns the
+    row actually carried, the only ones an existing product is updated with.
+    Raises ValueError for an invalid row.
+    """
+    if not isinstance(row, dict):
+        raise ValueError(row if isinstance(row, str) else 'Row is not an object')
+    sku = str(row.get('sku') or '').strip()
+    name = str(row.get('name') or '').strip()
+    if not sku:
+        raise ValueError('Missing sku')
+    if not name:
+        raise ValueError('Missing name')
+    # Only a missing value (or an empty CSV cell) counts as not given: an explicit 0 is kept
+    given = tuple(column for column in IMPORT_COLUMNS if row.get(column) not in (None, ''))
+    try:
+        stock = int(row['stock']) if 'stock' in given else 0
+        price = float(row['price'])
+        reorder_level = int(row['reorder_level']) if 'reorder_level' in given else LOW_STOCK_THRESHOLD
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Invalid stock, price or reorder level')
+    values = {
+        'name': name,
+        'category': row['category'] if 'category' in given else None,
+        'stock': stock,
+        'price': price,
+        'sku': sku,
+        'unit': row['unit'] if 'unit' in given else 'pc',
+        'reorder_level': reorder_level
+    }
+    return values, given
+
+def _upsert_chunk(rows):
+    """Insert or update a chunk of (values, given) products by SKU.
+
+    Existing products only get the columns their row gave, so rows are
+    upserted in one statement per distinct set of given columns (normally
+    one per chunk).
+    """
+    count = len(rows)
+    # Postgres refuses to touch the same row twice in one ON CONFLICT
+    # statement, so the last occurrence of a SKU within a chunk wins.
+    rows = {values['sku']: (values, given) for values, given in rows}.values()
+    groups = {}
+    for values, given in rows:
+        groups.setdefault(given, []).append(values)
+
+    for given, group in groups.items():
+        stmt = dialect_insert(Product.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['sku'],
+            set_=dict({column: stmt.excluded[column] for column in given if column != 'sku'},
+                      version=null())  # ON CONFLICT updates skip Column.onupdate
+        )
+        db.session.execute(stmt, group)
+    return count
+
+
+def _low_stock_by_sku(skus):
+    """{sku: is low stock} for the existing products among skus"""
+    rows = db.session.execute(
+        select(Product.sku, Product.stock, Product.reorder_level).where(Product.sku.in_(skus))
+    ).all()
+    return {row.sku: is_low_stock(row.stock, row.reorder_level) for row in rows}
+
+
+def _chunked_import(content_type, mode):
+    """Upsert products chunk by chunk, isolating failures per chunk.
+
+    A replace is all or nothing: if any row fails, the old catalog is kept.
+    """
+    try:
+        chunk_size = int(request.args.get('chunk_size', current_app.config['IMPORT_CHUNK_SIZE']))
+    except ValueError:
+        return jsonify({'error': 'Invalid chunk_size'}), 400
+    chunk_size = min(max(chunk_size, 1), IMPORT_MAX_CHUNK_SIZE)
+
+    reports = []
+    imported = failed = 0
+    # Dashboard deltas of an upsert (a replace recounts instead)
+    added_products = low_stock_delta = 0
+
+    def flush_chunk(rows, errors):
+        nonlocal imported, failed, added_products, low_stock_delta
+        report = {'chunk': len(reports) + 1, 'rows': len(rows) + len(errors), 'imported': 0, 'errors': errors}
+        if rows:
+            try:
+                # A savepoint per chunk: a failing chunk is rolled back on its own
+                with db.session.begin_nested():
+                    skus = list({values['sku'] for values, _given in rows})
+                    before = _low_stock_by_sku(skus) if mode == 'upsert' else {}
+                    report['imported'] = _upsert_chunk(rows)
+                    after = _low_stock_by_sku(skus) if mode == 'upsert' else {}
+                # Only counted once the chunk's savepoint was released
+                added_products += len(after) - len(before)
+                low_stock_delta += sum(after.values()) - sum(before.values())
+            except SQLAlchemyError as e:
+                report['errors'].append({'line': None, 'error': str(e.orig if hasattr(e, 'orig') else e)})
+        imported += report['imported']
+        failed += report['rows'] - report['imported']
+        reports.append(report)
+
+    removed_ids = []
+    try:
+        if mode == 'replace':
+            removed_ids = db.session.execute(select(Product.id)).scalars().all()
+            Product.query.delete()
+
+        rows, errors = [], []
+        for line_number, raw in _iter_import_rows(content_type):
+            try:
+                rows.append(_clean_import_row(raw))
+            except ValueError as e:
+                errors.append({'line': line_number, 'error': str(e)})
+            if len(rows) + len(errors) >= chunk_size:
+                flush_chunk(rows, errors)
+                rows, errors = [], []
+        if rows or errors:
+            flush_chunk(rows, errors)
+
+        if mode == 'replace' and failed:
+            # Committing would lose the products of the failed rows for good
+            db.session.rollback()
+            return jsonify({
+                'error': f'{failed} rows failed, the inventory was not replaced',
+                'mode': mode,
+                'imported': 0,
+                'failed': failed,
+                'chunks': reports
+            }), 400
+
+        if mode == 'replace':
+            # The whole catalog was replaced, so recount rather than apply deltas
+            rebuild_dashboard_stats()
+        else:
+            adjust_dashboard_stats(products=added_products, low_stock=low_stock_delta)
+        publish_catalog_change(deleted=removed_ids, reset=True)
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify({
+        'success': True,
+        'mode': mode,
+        'imported': imported,
+        'failed': failed,
+        'chunks': reports
+    })
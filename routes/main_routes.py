@@ -1,7 +1,8 @@
 from flask import Blueprint, render_template, session, redirect, url_for, jsonify
 from extensions import db
-from models import Product, BillingRecord, User
+from models import User
 from utils import login_required, get_user_permissions, owner_required
+from stats import get_dashboard_stats
 
 main_bp = Blueprint('main', __name__)
 
@@ -18,22 +19,16 @@ def home():
     """Render home page with dashboard stats"""
     permissions = get_user_permissions(session['user']['role'])
     
-    # Calculate stats
-    products = Product.query.all()
-    billing_history = BillingRecord.query.all()
-    
-    total_products = len(products)
-    low_stock_count = sum(1 for p in products if p.stock < 10)
-    total_transactions = len(billing_history)
-    total_revenue = sum(record.total for record in billing_history)
+    # Stats are maintained incrementally by the writers (see stats.py)
+    stats = get_dashboard_stats()
     
     return render_template('home.html',
         user=session['user'],
         permissions=permissions,
-        total_products=total_products,
-        low_stock_count=low_stock_count,
-        total_transactions=total_transactions,
-        total_revenue=total_revenue
+        total_products=stats.total_products,
+        low_stock_count=stats.low_stock_count,
+        total_transactions=stats.total_transactions,
+        total_revenue=stats.total_revenue
     )
 
 @main_bp.route('/settings')
@@ -0,0 +1,23 @@
+from flask import Blueprint, Response, request, jsonify, current_app
+from metrics import collect, render_metrics
+from utils import owner_required
+import hmac
+
+metrics_bp = Blueprint('metrics', __name__)
+
+def _render():
+    return Response(render_metrics(collect(current_app)), mimetype='text/plain; version=0.0.4')
+
+@metrics_bp.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint, merged across all workers (see metrics.py).
+
+    Scrapers authenticate with METRICS_TOKEN; without one configured only
+    a signed-in Owner can read it.
+    """
+    token = current_app.config['METRICS_TOKEN']
+    if not token:
+        return owner_required(_render)()
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return _render()
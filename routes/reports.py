@@ -0,0 +1,114 @@
+from flask import Blueprint, request, jsonify
+from sqlalchemy import select, func
+from extensions import db
+from models import SalesRollupProduct, SalesRollupCashier
+from utils import manager_required, parse_date_param
+from rollups import GRANULARITIES, METRICS, bucket_start
+from datetime import datetime, timedelta
+
+reports_bp = Blueprint('reports', __name__)
+
+# Range used when no start is given, per granularity
+DEFAULT_REPORT_SPAN = {'hour': timedelta(hours=48), 'day': timedelta(days=30)}
+
+# Hard cap on buckets per report (e.g. a year of hourly rows per product)
+REPORT_MAX_ROWS = 10000
+
+REPORT_GROUPS = ('total', 'product', 'cashier')
+
+
+def _round_metrics(row):
+    return {
+        'transactions': int(row.transactions or 0),
+        'units': int(row.units or 0),
+        'gross': round(row.gross or 0, 2),
+        'discount': round(row.discount or 0, 2),
+        'gst': round(row.gst or 0, 2),
+        'revenue': round(row.revenue or 0, 2)
+    }
+
+
+@reports_bp.route('/api/reports/sales', methods=['GET'])
+@manager_required
+def sales_report():
+    """Revenue, units, GST and discount per time bucket.
+
+    Query params: start / end (YYYY-MM-DD or ISO datetime, end inclusive for
+    bare dates), granularity (hour | day) and group (total | product |
+    cashier). Served entirely from the rollup tables (see rollups.py).
+    """
+    granularity = request.args.get('granularity', 'day')
+    group = request.args.get('group', 'total')
+    if granularity not in GRANULARITIES:
+        return jsonify({'error': f"granularity must be one of {', '.join(GRANULARITIES)}"}), 400
+    if group not in REPORT_GROUPS:
+        return jsonify({'error': f"group must be one of {', '.join(REPORT_GROUPS)}"}), 400
+
+    try:
+        end = parse_date_param(request.args.get('end'), end=True) or datetime.now()
+        start = parse_date_param(request.args.get('start')) or end - DEFAULT_REPORT_SPAN[granularity]
+    except ValueError:
+        return jsonify({'error': 'Invalid date'}), 400
+    if start >= end:
+        return jsonify({'error': 'start must be before end'}), 400
+    # Buckets are whole hours/days: include the one the start falls in
+    start = bucket_start(start, granularity)
+
+    # Cashier rollups hold bill-level totals, so they also give the overall figures
+    model = SalesRollupProduct if group == 'product' else SalesRollupCashier
+    metrics = [func.sum(getattr(model, name)).label(name) for name in METRICS]
+    keys = [model.bucket_start]
+    labels = []
+    if group == 'product':
+        keys.append(model.product_id)
+        # (granularity, bucket, product) is the primary key, so each group is one row
+        # and its name is the latest snapshot seen in that bucket
+        labels.append(model.product_name)
+    elif group == 'cashier':
+        keys.append(model.cashier)
+
+    stmt = (
+        select(*keys, *labels, *metrics)
+        .where(model.granularity == granularity, model.bucket_start >= start, model.bucket_start < end)
+        .group_by(*keys, *labels)
+        .order_by(model.bucket_start)
+        .limit(REPORT_MAX_ROWS + 1)
+    )
+    rows = db.session.execute(stmt).all()
+    if len(rows) > REPORT_MAX_ROWS:
+        return jsonify({'error': 'Range too large for this granularity, narrow it down'}), 400
+
+    buckets = []
+    totals = dict.fromkeys(METRICS, 0)
+    for row in rows:
+        bucket = {'bucket': row.bucket_start.isoformat()}
+        if group == 'product':
+            bucket['productId'] = row.product_id
+            bucket['productName'] = row.product_name
+        elif group == 'cashier':
+            bucket['cashier'] = row.cashier
+        bucket.update(_round_metrics(row))
+        buckets.append(bucket)
+        if group != 'product':
+            for name in totals:
+                totals[name] += bucket[name]
+
+    if group == 'product':
+        # A sale spans several products: count it once in the totals
+        total_row = db.session.execute(
+            select(*[func.sum(getattr(SalesRollupCashier, name)).label(name) for name in totals])
+            .where(SalesRollupCashier.granularity == granularity,
+                   SalesRollupCashier.bucket_start >= start, SalesRollupCashier.bucket_start < end)
+        ).one()
+        totals = _round_metrics(total_row)
+    else:
+        totals = {name: round(value, 2) for name, value in totals.items()}
+
+    return jsonify({
+        'granularity': granularity,
+        'group': group,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'buckets': buckets,
+        'totals': totals
+    })
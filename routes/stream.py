@@ -0,0 +1,90 @@
+from flask import Blueprint, Response, request, current_app
+from extensions import db
+from utils import cashier_required
+from stock_events import stock_event_broker, load_messages, BACKFILL_MAX_VERSIONS, StreamLimitReached
+import json
+import queue
+import time
+
+stream_bp = Blueprint('stream', __name__)
+
+# EventSource reconnect delay sent to browsers (ms)
+STREAM_RETRY_MS = 3000
+
+# Retry-After (seconds) when this worker has no stream slot left
+STREAM_BUSY_RETRY_AFTER = 10
+
+def _sse(version, payload):
+    return f'id: {version}\nevent: stock\ndata: {json.dumps(payload)}\n\n'
+
+def _reset(version):
+    return _sse(version, {'products': [], 'deleted': [], 'reset': True})
+
+def _parse_last_event_id():
+    value = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+@stream_bp.route('/api/stream/stock')
+@cashier_required
+def stock_stream():
+    """Server-Sent Events: product stock / price changes as they are committed (see stock_events.py)"""
+    app = current_app._get_current_object()
+    keepalive = app.config['STOCK_STREAM_KEEPALIVE']
+    max_age = app.config['STOCK_STREAM_MAX_AGE']
+    last_seen = _parse_last_event_id()
+
+    try:
+        subscriber, start = stock_event_broker.subscribe(app)
+    except StreamLimitReached:
+        # Keep the remaining threads for checkouts; the terminal tries again later
+        response = Response(f'retry: {STREAM_BUSY_RETRY_AFTER * 1000}\n\n', status=503, mimetype='text/event-stream')
+        response.headers['Retry-After'] = str(STREAM_BUSY_RETRY_AFTER)
+        return response
+    try:
+        # A reconnecting terminal first gets what it missed, if that is still in the table
+        backlog, reset = [], False
+        if last_seen is not None and last_seen != start:
+            reset = True
+            if 0 < start - last_seen <= BACKFILL_MAX_VERSIONS:
+                backlog = load_messages(last_seen, up_to=start)
+                # Every version in between must still be there
+                reset = [version for version, _payload in backlog] != list(range(last_seen + 1, start + 1))
+    except Exception:
+        stock_event_broker.unsubscribe(subscriber)
+        raise
+    # The stream itself never touches the database: give the connection back
+    db.session.remove()
+
+    def generate():
+        try:
+            yield f'retry: {STREAM_RETRY_MS}\n\n'
+            if reset:
+                yield _reset(start)
+            elif backlog:
+                for version, payload in backlog:
+                    yield _sse(version, payload)
+            else:
+                # Gives the terminal an id to resume from even if nothing changes
+                yield _sse(start, {'products': [], 'deleted': [], 'reset': False})
+
+            # Streams end after max_age so threads are recycled; the browser reconnects
+            deadline = time.monotonic() + max_age
+            while time.monotonic() < deadline:
+                try:
+                    version, payload = subscriber.queue.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if subscriber.overflowed:
+                    return  # Fell behind: reconnect and catch up from the table
+                yield _sse(version, payload)
+        finally:
+            stock_event_broker.unsubscribe(subscriber)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # Don't let a reverse proxy buffer the stream
+    })
@@ -0,0 +1,201 @@
+"""
+Database-backed server-side sessions (SESSION_TYPE = 'database').
+
+Replaces Flask-Session's filesystem store so sessions are shared by every
+gunicorn worker and node that uses the same database:
+
+* rows live in `web_sessions` with an indexed `expiry` column;
+* a background thread per worker deletes expired rows every
+  SESSION_SWEEP_INTERVAL seconds (an idempotent DELETE, so several
+  sweepers are harmless);
+* a small per-worker read cache (SESSION_CACHE_TTL seconds) saves a store
+  hit on back-to-back requests; writes from this worker update it directly,
+  so only changes made by *other* workers can be up to TTL seconds late;
+* unchanged sessions are only rewritten when their expiry needs refreshing
+  (at most every SESSION_REFRESH_INTERVAL seconds), not on every request.
+
+All statements run on their own connection, independent of db.session, so
+saving the session never commits (or rolls back) the request's work.
+"""
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface
+from flask_session.sessions import ServerSideSession
+from sqlalchemy import select, delete
+from extensions import db
+from models import WebSession
+from utils import dialect_insert
+
+
+class _SessionReadCache:
+    """Tiny TTL + LRU cache of sid -> (data, expiry)"""
+
+    def __init__(self, ttl, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            cached_at, value = entry
+            if time.monotonic() - cached_at > self.ttl:
+                del self._entries[sid]
+                return None
+            self._entries.move_to_end(sid)
+            return value
+
+    def set(self, sid, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[sid] = (time.monotonic(), value)
+            self._entries.move_to_end(sid)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+
+class DatabaseSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, app):
+        self.cache = _SessionReadCache(app.config['SESSION_CACHE_TTL'])
+        self.refresh_interval = timedelta(seconds=app.config['SESSION_REFRESH_INTERVAL'])
+        self.sweep_interval = app.config['SESSION_SWEEP_INTERVAL']
+        self._sweeper_pid = None
+        self._sweeper_lock = threading.Lock()
+
+    # ----- store access -----
+
+    def _load(self, sid):
+        cached = self.cache.get(sid)
+        if cached is not None:
+            return cached
+
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                select(WebSession.data, WebSession.expiry).where(WebSession.session_id == sid)
+            ).first()
+        if row is None:
+            return None
+        value = (row.data, row.expiry)
+        self.cache.set(sid, value)
+        return value
+
+    def _store(self, sid, data, expiry):
+        table = WebSession.__table__
+        stmt = dialect_insert(table).values(session_id=sid, data=data, expiry=expiry)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['session_id'],
+            set_={'data': stmt.excluded.data, 'expiry': stmt.excluded.expiry}
+        )
+        with db.engine.begin() as conn:
+            conn.execute(stmt)
+        self.cache.set(sid, (data, expiry))
+
+    def _delete(self, sid):
+        with db.engine.begin() as conn:
+            conn.execute(delete(WebSession).where(WebSession.session_id == sid))
+        self.cache.discard(sid)
+
+    # ----- SessionInterface -----
+
+    def open_session(self, app, request):
+        self._ensure_sweeper(app)
+
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            stored = self._load(sid)
+            if stored is not None:
+                data, expiry = stored
+                if expiry > datetime.utcnow():
+                    session = ServerSideSession(self.serializer.loads(data.decode()), sid=sid)
+                    session.stored_expiry = expiry
+                    return session
+                self.cache.discard(sid)
+
+        session = ServerSideSession(sid=secrets.token_urlsafe(32))
+        session.stored_expiry = None
+        return session
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        name = self.get_cookie_name(app)
+
+        if not session:
+            if session.modified:
+                if session.stored_expiry is not None:
+                    self._delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        # Server-side expiry is always set so the sweeper can reclaim rows,
+        # even for non-permanent (browser-session) cookies
+        now = datetime.utcnow()
+        expiry = now + app.permanent_session_lifetime
+        stale = (
+            session.stored_expiry is None
+            or expiry - session.stored_expiry >= self.refresh_interval
+        )
+        if not session.modified and not (stale and self.should_set_cookie(app, session)):
+            return
+
+        self._store(session.sid, self.serializer.dumps(dict(session)).encode(), expiry)
+        session.stored_expiry = expiry
+        response.set_cookie(
+            name, session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain, path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+    # ----- expiry sweeper -----
+
+    def _ensure_sweeper(self, app):
+        """Start one sweeper thread per process (after any fork by gunicorn)"""
+        if self.sweep_interval <= 0 or self._sweeper_pid == os.getpid():
+            return
+        with self._sweeper_lock:
+            if self._sweeper_pid == os.getpid():
+                return
+            self._sweeper_pid = os.getpid()
+            thread = threading.Thread(
+                target=self._sweep_forever, args=(app,), name='session-sweeper', daemon=True
+            )
+            thread.start()
+
+    def _sweep_forever(self, app):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                with app.app_context():
+                    sweep_expired_sessions()
+            except Exception:
+                app.logger.exception('Session sweep failed')
+
+
+def sweep_expired_sessions():
+    """Delete expired session rows; returns how many were removed"""
+    with db.engine.begin() as conn:
+        result = conn.execute(delete(WebSession).where(WebSession.expiry < datetime.utcnow()))
+    return result.rowcount
+
+
+def init_session_store(app):
+    """Install the database session interface on the app"""
+    app.session_interface = DatabaseSessionInterface(app)
@@ -0,0 +1,29 @@
+"""
+Application signals (blinker, the same mechanism as Flask's own signals).
+
+`low_stock` is sent once a committed change takes a product from at or
+above its reorder level to below it. The sender is the app and the
+product is passed as a product dict, so receivers (logging,
+notifications, live stock feeds) react to the crossing instead of
+polling /api/products/low-stock.
+"""
+from blinker import Namespace
+from models import product_dict
+
+_signals = Namespace()
+
+low_stock = _signals.signal('low-stock')
+
+
+def emit_low_stock(app, products):
+    """Send `low_stock` for each product (call after the commit)"""
+    for product in products:
+        low_stock.send(app, product=product_dict(product))
+
+
+def log_low_stock(app, product):
+    """Default receiver: record the crossing in the app log"""
+    app.logger.warning(
+        'Low stock: %s (SKU %s) down to %s, reorder level %s',
+        product['name'], product['sku'], product['stock'], product['reorder_level']
+    )
@@ -0,0 +1,97 @@
+"""
+Dashboard aggregates (product count, low-stock count, transactions, revenue).
+
+The numbers live in a single `dashboard_stats` row that every writer adjusts
+with an atomic UPDATE inside its own transaction, so the /home view is one
+primary-key read no matter how many products or sales exist. The row stays
+locked until the writer commits; spreading it over several rows would not
+let writers run further in parallel, as each of them also bumps the single
+catalog version row (see stock_events.py), which orders the stock stream.
+`rebuild_dashboard_stats()` recomputes the row from the source tables and is
+exposed as `flask rebuild-stats` for reconciliation.
+"""
+from datetime import datetime
+from sqlalchemy import func, case, update
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import DashboardStats, Product, BillingRecord, LOW_STOCK_THRESHOLD, low_stock_condition
+
+STATS_ROW_ID = 1
+
+
+def is_low_stock(stock, reorder_level=LOW_STOCK_THRESHOLD):
+    """Whether a stock level counts towards the low-stock tally (same rule as low_stock_condition)"""
+    return stock is not None and stock < reorder_level
+
+
+def rebuild_dashboard_stats():
+    """Recompute the stats row from products and billing records (caller commits)"""
+    # Make sure pending changes in this transaction are part of the totals
+    db.session.flush()
+    # Lock the row before counting. A writer that already adjusted it has to
+    # commit first, so its changes are counted; one that hasn't waits for
+    # this transaction and then adds its delta on top of the new totals.
+    db.session.execute(
+        update(DashboardStats).where(DashboardStats.id == STATS_ROW_ID)
+        .values(updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+
+    total_products, low_stock_count = db.session.query(
+        func.count(Product.id),
+        func.coalesce(func.sum(case((low_stock_condition(), 1), else_=0)), 0)
+    ).one()
+    total_transactions, total_revenue = db.session.query(
+        func.count(BillingRecord.id),
+        func.coalesce(func.sum(BillingRecord.total), 0.0)
+    ).one()
+
+    stats = db.session.get(DashboardStats, STATS_ROW_ID)
+    if stats is None:
+        stats = DashboardStats(id=STATS_ROW_ID)
+        db.session.add(stats)
+
+    stats.total_products = total_products
+    stats.low_stock_count = low_stock_count
+    stats.total_transactions = total_transactions
+    stats.total_revenue = float(total_revenue)
+    db.session.flush()
+    return stats
+
+
+def get_dashboard_stats():
+    """Return the stats row, building it on first use"""
+    stats = db.session.get(DashboardStats, STATS_ROW_ID)
+    if stats is not None:
+        return stats
+
+    try:
+        stats = rebuild_dashboard_stats()
+        db.session.commit()
+    except IntegrityError:
+        # Another worker created the row first
+        db.session.rollback()
+        stats = db.session.get(DashboardStats, STATS_ROW_ID)
+    return stats
+
+
+def adjust_dashboard_stats(products=0, low_stock=0, transactions=0, revenue=0.0):
+    """Apply deltas to the stats row in the current transaction (caller commits)"""
+    if not (products or low_stock or transactions or revenue):
+        return
+
+    result = db.session.execute(
+        update(DashboardStats)
+        .where(DashboardStats.id == STATS_ROW_ID)
+        .values(
+            total_products=DashboardStats.total_products + products,
+            low_stock_count=DashboardStats.low_stock_count + low_stock,
+            total_transactions=DashboardStats.total_transactions + transactions,
+            total_revenue=DashboardStats.total_revenue + revenue
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        # Row doesn't exist yet: build it from scratch, which already
+        # includes this transaction's (flushed) changes.
+        rebuild_dashboard_stats()
@@ -0,0 +1,195 @@
+"""
+Live product stock / price updates for POS terminals (/api/stream/stock).
+
+Everything that changes products calls publish_catalog_change(), which
+bumps the shared catalog version (see catalog_cache.py) and writes a
+stock_events row with the changed products in the same transaction. The
+table is the broker between gunicorn workers and nodes:
+
+* the version bump is an upsert on one row, so it is held locked until the
+  transaction commits and versions become visible in commit order. A
+  reader that has seen version N has seen every change up to N;
+* each worker runs one poller thread that, while at least one terminal is
+  connected, reads the events after the last version it delivered every
+  STOCK_STREAM_POLL_INTERVAL seconds and hands them to its connected
+  streams. N terminals cost one indexed range query per worker per
+  interval, not N;
+* each worker serves at most STOCK_STREAM_MAX_PER_WORKER streams at once, so
+  open streams can't take every gunicorn thread away from checkouts; extra
+  terminals get a 503 and retry;
+* the version is the SSE event id. A reconnecting terminal sends
+  Last-Event-ID and gets the changes it missed from the table, or a reset
+  (reload the catalog) when they are no longer there.
+
+The same version stamps the changed product rows and the tombstones of
+deleted ones, which is what GET /api/products?since=<version> reads.
+
+Old events are deleted by `flask sweep-stock-events`.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, insert, select, update
+from extensions import db
+from models import Product, ProductTombstone, StockEvent
+from catalog_cache import bump_catalog_version, get_catalog_version
+from utils import dialect_insert
+
+# Event rows read per poll (the rest follow on the next poll)
+POLL_BATCH_SIZE = 1000
+
+# Messages buffered for one terminal; a terminal that falls further behind is
+# disconnected and catches up through Last-Event-ID
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+# Versions a reconnecting terminal may replay before it is told to reset
+BACKFILL_MAX_VERSIONS = 1000
+
+
+def publish_catalog_change(updated=(), deleted=(), reset=False):
+    """Bump the catalog version and record the change for the stock stream.
+
+    updated are products (instances or rows with id, stock, price), deleted
+    are product ids; reset=True tells terminals to reload the catalog when
+    too much changed to list (imports). Runs in the current transaction
+    (caller commits); returns the new version.
+    """
+    version = bump_catalog_version()
+
+    # Stamp every product row this transaction wrote (their version is NULL)
+    db.session.flush()
+    db.session.execute(
+        update(Product).where(Product.version.is_(None)).values(version=version)
+        .execution_options(synchronize_session=False)
+    )
+    if deleted:
+        stmt = dialect_insert(ProductTombstone.__table__)
+        stmt = stmt.on_conflict_do_update(index_elements=['product_id'], set_={'version': stmt.excluded.version})
+        db.session.execute(stmt, [{'product_id': product_id, 'version': version} for product_id in deleted])
+
+    payload = {
+        'products': [{'id': p.id, 'stock': p.stock, 'price': p.price} for p in updated],
+        'deleted': list(deleted),
+        'reset': reset,
+    }
+    db.session.execute(insert(StockEvent).values(version=version, payload=json.dumps(payload)))
+    return version
+
+
+def _merge(rows):
+    """One message per version: [(version, payload)]"""
+    messages = []
+    for row in rows:
+        payload = json.loads(row.payload)
+        if messages and messages[-1][0] == row.version:
+            merged = messages[-1][1]
+            merged['products'] += payload['products']
+            merged['deleted'] += payload['deleted']
+            merged['reset'] = merged['reset'] or payload['reset']
+        else:
+            messages.append((row.version, payload))
+    return messages
+
+
+def load_messages(after, up_to=None):
+    """Messages for the versions after `after` (up to `up_to`), oldest first"""
+    stmt = select(StockEvent.version, StockEvent.payload).where(StockEvent.version > after)
+    if up_to is not None:
+        stmt = stmt.where(StockEvent.version <= up_to)
+    rows = db.session.execute(stmt.order_by(StockEvent.version, StockEvent.id).limit(POLL_BATCH_SIZE)).all()
+    if len(rows) == POLL_BATCH_SIZE and rows[0].version != rows[-1].version:
+        # The last version may be cut short: leave it for the next read
+        rows = [row for row in rows if row.version != rows[-1].version]
+    return _merge(rows)
+
+
+def sweep_stock_events():
+    """Delete events older than STOCK_EVENT_RETENTION; returns how many were removed (caller commits)"""
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['STOCK_EVENT_RETENTION'])
+    return db.session.execute(delete(StockEvent).where(StockEvent.created_at < cutoff)).rowcount
+
+
+class Subscriber:
+    """One connected stream's message queue"""
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def put(self, version, payload):
+        try:
+            self.queue.put_nowait((version, payload))
+        except queue.Full:
+            self.overflowed = True
+
+
+class StreamLimitReached(Exception):
+    """This worker already serves STOCK_STREAM_MAX_PER_WORKER streams"""
+
+
+class StockEventBroker:
+    """Per-worker fan-out of stock events to the streams connected to it"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._subscribers = set()
+        self._version = None  # Last version delivered (None while nobody listens)
+        self._poller_pid = None
+
+    def subscribe(self, app):
+        """Register a stream; returns (subscriber, version its messages start after).
+
+        Raises StreamLimitReached when the worker is at STOCK_STREAM_MAX_PER_WORKER.
+        """
+        with self._condition:
+            if self._poller_pid != os.getpid():
+                # First stream in this process (or after gunicorn forked us)
+                self._subscribers = set()
+                self._version = None
+                self._poller_pid = os.getpid()
+                threading.Thread(target=self._poll_forever, args=(app,), name='stock-events', daemon=True).start()
+            if len(self._subscribers) >= app.config['STOCK_STREAM_MAX_PER_WORKER']:
+                raise StreamLimitReached()
+            if self._version is None:
+                self._version = get_catalog_version()
+            subscriber = Subscriber()
+            self._subscribers.add(subscriber)
+            self._condition.notify()
+            return subscriber, self._version
+
+    def unsubscribe(self, subscriber):
+        with self._condition:
+            self._subscribers.discard(subscriber)
+
+    def _poll_forever(self, app):
+        interval = app.config['STOCK_STREAM_POLL_INTERVAL']
+        while True:
+            with self._condition:
+                while not self._subscribers:
+                    # Idle: the next subscriber starts from the then-current version
+                    self._version = None
+                    self._condition.wait()
+                after = self._version
+
+            try:
+                with app.app_context():
+                    messages = load_messages(after)
+            except Exception:
+                app.logger.exception('Stock event poll failed')
+                messages = []
+
+            with self._condition:
+                # Skip delivery if everyone left (and maybe came back) meanwhile
+                if messages and self._version == after:
+                    for version, payload in messages:
+                        for subscriber in self._subscribers:
+                            subscriber.put(version, payload)
+                    self._version = messages[-1][0]
+            time.sleep(interval)
+
+
+stock_event_broker = StockEventBroker()
@@ -0,0 +1,91 @@
+"""
+Shared setup for the test modules.
+
+The app reads its configuration from the environment when it is first
+imported, so every test module imports this one before anything from the
+app: the whole run shares one throwaway SQLite database, removed when the
+process exits. Tests create their own products (unique SKUs) and cashiers,
+so they don't depend on what other modules left behind.
+"""
+import atexit
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+
+_tmp = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, _tmp, ignore_errors=True)
+os.environ.update({
+    'DATABASE_URL': f'sqlite:///{_tmp}/test.db',
+    'INVOICE_CACHE_DIR': os.path.join(_tmp, 'invoices'),
+    'METRICS_ENABLED': 'false',
+    # No session read cache or refresh writes: every request loads its session the same way
+    'SESSION_CACHE_TTL': '0',
+    'SESSION_REFRESH_INTERVAL': str(24 * 3600),
+    'SESSION_SWEEP_INTERVAL': '0',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, create_default_admin  # noqa: E402
+from migrations import upgrade_database  # noqa: E402
+
+CASHIER_PASSWORD = 'cashier-pass'
+
+_database_ready = False
+_names = itertools.count(1)
+
+
+def unique_name(prefix):
+    """A name no other test in this run uses"""
+    return f'{prefix}{next(_names)}'
+
+
+def _setup_database():
+    global _database_ready
+    if not _database_ready:
+        app.config['TESTING'] = True
+        with app.app_context():
+            upgrade_database(log=lambda message: None)
+            create_default_admin(app)
+        _database_ready = True
+
+
+def login(username, password):
+    """A test client signed in as username"""
+    _setup_database()
+    client = app.test_client()
+    response = client.post('/login', json={'username': username, 'password': password})
+    assert response.status_code == 200, response.data
+    return client
+
+
+def owner_client():
+    return login(app.config['ADMIN_USERNAME'], app.config['ADMIN_PASSWORD'])
+
+
+def cashier_client(owner):
+    """Create a new cashier through owner and sign them in; returns (client, username)"""
+    username = unique_name('cashier')
+    response = owner.post('/api/user', json={'username': username, 'password': CASHIER_PASSWORD, 'role': 'Cashier'})
+    assert response.status_code == 201, response.data
+    return login(username, CASHIER_PASSWORD), username
+
+
+def create_product(client, **fields):
+    """POST /api/product with sensible defaults; returns the product as JSON"""
+    body = {'name': unique_name('Product '), 'category': 'Test', 'stock': 10, 'price': 2.5,
+            'sku': unique_name('SKU-')}
+    body.update(fields)
+    response = client.post('/api/product', json=body)
+    assert response.status_code == 201, response.data
+    return response.json
+
+
+def cart(*lines):
+    """Checkout body for (product, quantity) lines, without discount or GST"""
+    items = [{'id': product['id'], 'name': product['name'], 'price': product['price'], 'quantity': quantity}
+             for product, quantity in lines]
+    total = sum(product['price'] * quantity for product, quantity in lines)
+    return {'items': items, 'subtotal': total, 'discountPercent': 0, 'discountAmount': 0,
+            'gstRate': 0, 'gstAmount': 0, 'total': total}
@@ -0,0 +1,51 @@
+"""
+GET /api/billing must load a page of history with a fixed number of
+statements, however many records and items there are (no N+1).
+
+Run with `python -m unittest discover tests` (or pytest).
+"""
+import unittest
+
+from support import app, owner_client, cashier_client, create_product, cart
+from query_profiler import query_budget
+
+CART_LINES = 3
+
+
+class BillingHistoryQueryCountTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        owner = owner_client()
+        # A cashier of its own, so the history page only holds this test's records
+        cls.client, cls.cashier = cashier_client(owner)
+        cls.products = [create_product(owner, stock=10000) for _ in range(CART_LINES)]
+
+    def _seed_records(self, total):
+        """Check out carts until the cashier has `total` billing records"""
+        while self._record_count() < total:
+            response = self.client.post('/api/billing', json=cart(*[(product, 1) for product in self.products]))
+            self.assertEqual(response.status_code, 201, response.data)
+
+    def _record_count(self):
+        from models import BillingRecord
+        with app.app_context():
+            return BillingRecord.query.filter_by(created_by=self.cashier).count()
+
+    def _history_statements(self):
+        with app.app_context(), query_budget(label='GET /api/billing') as profile:
+            response = self.client.get(f'/api/billing?limit=50&cashier={self.cashier}')
+        self.assertEqual(response.status_code, 200, response.data)
+        return len(response.json['records']), len(profile.statements)
+
+    def test_statement_count_does_not_grow_with_records(self):
+        self._seed_records(2)
+        few_records, few_statements = self._history_statements()
+        self._seed_records(50)
+        many_records, many_statements = self._history_statements()
+
+        self.assertEqual((few_records, many_records), (2, 50))
+        self.assertEqual(few_statements, many_statements)
+
+
+if __name__ == '__main__':
+    unittest.main()
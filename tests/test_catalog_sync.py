@@ -0,0 +1,118 @@
+"""
+Delta sync (GET /api/products?since=) and the dashboard stats row, which
+every write adjusts instead of recounting: both must agree with the tables.
+"""
+import json
+import unittest
+
+from support import app, owner_client, create_product, cart, unique_name
+from extensions import db
+
+
+def _catalog_version(client):
+    response = client.get('/api/products?since=0')
+    return int(response.headers['X-Catalog-Version'])
+
+
+class DeltaSyncTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.client = owner_client()
+
+    def test_delta_holds_changes_and_deletions_since_version(self):
+        unchanged = create_product(self.client)
+        edited = create_product(self.client)
+        removed = create_product(self.client)
+        since = _catalog_version(self.client)
+
+        added = create_product(self.client)
+        self.client.put(f'/api/product/{edited["id"]}', json={'price': 9.75})
+        self.client.delete(f'/api/product/{removed["id"]}')
+        response = self.client.get(f'/api/products?since={since}')
+
+        self.assertEqual(response.status_code, 200, response.data)
+        delta = response.json
+        self.assertFalse(delta['full'])
+        self.assertEqual(delta['version'], int(response.headers['X-Catalog-Version']))
+        changed = {product['id']: product for product in delta['products']}
+        self.assertEqual(set(changed), {added['id'], edited['id']})
+        self.assertEqual(changed[edited['id']]['price'], 9.75)
+        self.assertNotIn(unchanged['id'], changed)
+        self.assertEqual(delta['deleted'], [removed['id']])
+
+    def test_checkout_shows_up_in_the_delta(self):
+        product = create_product(self.client, stock=5)
+        since = _catalog_version(self.client)
+        self.assertEqual(self.client.post('/api/billing', json=cart((product, 2))).status_code, 201)
+
+        delta = self.client.get(f'/api/products?since={since}').json
+
+        self.assertEqual([(p['id'], p['stock']) for p in delta['products']], [(product['id'], 3)])
+
+    def test_unknown_version_gets_the_full_catalog(self):
+        version = _catalog_version(self.client)
+        delta = self.client.get(f'/api/products?since={version + 1000}').json
+        self.assertTrue(delta['full'])
+        self.assertEqual(delta['deleted'], [])
+
+    def test_unchanged_catalog_is_not_modified(self):
+        response = self.client.get('/api/products')
+        again = self.client.get('/api/products', headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(again.status_code, 304)
+
+        create_product(self.client)
+        changed = self.client.get('/api/products', headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(changed.status_code, 200)
+
+
+class DashboardStatsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.client = owner_client()
+
+    def assertStatsMatchTables(self):
+        from stats import get_dashboard_stats, rebuild_dashboard_stats
+
+        def totals(stats):
+            return (stats.total_products, stats.low_stock_count, stats.total_transactions,
+                    round(stats.total_revenue, 2))
+
+        with app.app_context():
+            stored = totals(get_dashboard_stats())
+            recounted = totals(rebuild_dashboard_stats())
+            db.session.rollback()
+        self.assertEqual(stored, recounted)
+
+    def test_product_edits(self):
+        product = create_product(self.client, stock=20, reorder_level=5)
+        low = create_product(self.client, stock=1, reorder_level=5)
+        self.client.put(f'/api/product/{product["id"]}', json={'stock': 2})
+        self.client.put(f'/api/product/{low["id"]}', json={'reorder_level': 0})
+        self.client.delete(f'/api/product/{product["id"]}')
+        self.assertStatsMatchTables()
+
+    def test_checkouts(self):
+        product = create_product(self.client, stock=12, reorder_level=10)
+        self.client.post('/api/billing', json=cart((product, 3)))
+        self.client.post('/api/billing/batch', json={'sales': [
+            dict(cart((product, 1)), idempotencyKey=unique_name('stats-')),
+            dict(cart((product, 50)), idempotencyKey=unique_name('stats-')),
+        ]})
+        self.assertStatsMatchTables()
+
+    def test_upsert_import(self):
+        existing = create_product(self.client, stock=50, reorder_level=5)
+        rows = [
+            {'sku': existing['sku'], 'name': existing['name'], 'price': 1, 'stock': 2},
+            {'sku': unique_name('IMP-'), 'name': 'Imported', 'price': 1, 'stock': 0},
+            {'sku': unique_name('IMP-'), 'name': 'Imported', 'price': 1, 'stock': 'not a number'},
+            {'sku': unique_name('IMP-'), 'name': 'Imported', 'price': 1, 'stock': 100},
+        ]
+        response = self.client.post('/api/import?chunk_size=2', content_type='application/x-ndjson',
+                                    data=''.join(json.dumps(row) + '\n' for row in rows))
+        self.assertEqual((response.json['imported'], response.json['failed']), (3, 1))
+        self.assertStatsMatchTables()
+
+
+if __name__ == '__main__':
+    unittest.main()
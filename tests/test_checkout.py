@@ -0,0 +1,147 @@
+"""
+POST /api/billing and /api/billing/batch: stock is never oversold and a
+retried sale (same Idempotency-Key) is recorded once.
+"""
+import unittest
+from unittest import mock
+
+from support import app, owner_client, create_product, cart, unique_name
+from extensions import db
+import routes.billing as billing
+
+
+def _stock(product_id):
+    from models import Product
+    with app.app_context():
+        return db.session.get(Product, product_id).stock
+
+
+def _record_count():
+    from models import BillingRecord
+    with app.app_context():
+        return BillingRecord.query.count()
+
+
+class StockConflictTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.client = owner_client()
+
+    def test_insufficient_stock_is_a_conflict(self):
+        product = create_product(self.client, stock=2)
+        response = self.client.post('/api/billing', json=cart((product, 3)))
+        self.assertEqual(response.status_code, 409, response.data)
+        self.assertIn('Insufficient stock', response.json['error'])
+        self.assertEqual(_stock(product['id']), 2)
+
+    def test_conflict_leaves_every_line_untouched(self):
+        plenty = create_product(self.client, stock=10)
+        scarce = create_product(self.client, stock=1)
+        response = self.client.post('/api/billing', json=cart((plenty, 4), (scarce, 2)))
+        self.assertEqual(response.status_code, 409, response.data)
+        self.assertEqual((_stock(plenty['id']), _stock(scarce['id'])), (10, 1))
+
+    def test_lines_of_one_product_add_up(self):
+        product = create_product(self.client, stock=3)
+        response = self.client.post('/api/billing', json=cart((product, 2), (product, 2)))
+        self.assertEqual(response.status_code, 409, response.data)
+        response = self.client.post('/api/billing', json=cart((product, 2), (product, 1)))
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(_stock(product['id']), 0)
+
+
+class IdempotencyTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.client = owner_client()
+        cls.product = create_product(cls.client, stock=100)
+
+    def _checkout(self, key, body):
+        return self.client.post('/api/billing', json=body, headers={'Idempotency-Key': key})
+
+    def test_retry_replays_the_first_response(self):
+        key = unique_name('key-')
+        body = cart((self.product, 2))
+        stock, records = _stock(self.product['id']), _record_count()
+
+        first = self._checkout(key, body)
+        retry = self._checkout(key, body)
+
+        self.assertEqual((first.status_code, retry.status_code), (201, 201))
+        self.assertNotIn('Idempotent-Replayed', first.headers)
+        self.assertEqual(retry.headers.get('Idempotent-Replayed'), 'true')
+        self.assertEqual(retry.json, first.json)
+        self.assertEqual(_stock(self.product['id']), stock - 2)
+        self.assertEqual(_record_count(), records + 1)
+
+    def test_key_reused_for_another_cart_is_rejected(self):
+        key = unique_name('key-')
+        self.assertEqual(self._checkout(key, cart((self.product, 1))).status_code, 201)
+        stock = _stock(self.product['id'])
+
+        response = self._checkout(key, cart((self.product, 5)))
+
+        self.assertEqual(response.status_code, 422, response.data)
+        self.assertEqual(_stock(self.product['id']), stock)
+
+
+class BatchTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.client = owner_client()
+
+    def _sale(self, *lines, key=None):
+        return dict(cart(*lines), idempotencyKey=key or unique_name('batch-'))
+
+    def test_results_per_sale(self):
+        product = create_product(self.client, stock=5)
+        sales = [self._sale((product, 2)), self._sale((product, 10)), self._sale((product, 3))]
+
+        response = self.client.post('/api/billing/batch', json={'sales': sales})
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual([result['status'] for result in response.json['results']], [201, 409, 201])
+        self.assertEqual(response.json['recorded'], 2)
+        self.assertEqual(_stock(product['id']), 0)
+
+    def test_resent_batch_is_replayed(self):
+        product = create_product(self.client, stock=5)
+        sales = [self._sale((product, 1)), self._sale((product, 1))]
+        self.client.post('/api/billing/batch', json={'sales': sales})
+
+        response = self.client.post('/api/billing/batch', json={'sales': sales})
+
+        self.assertEqual(response.json['recorded'], 0)
+        self.assertTrue(all(result.get('replayed') for result in response.json['results']))
+        self.assertEqual(_stock(product['id']), 3)
+
+    def test_conflict_with_a_concurrent_checkout_is_retried(self):
+        product = create_product(self.client, stock=5)
+        apply_batch = billing._apply_sales_batch
+        attempts = []
+
+        def conflict_once(*args):
+            attempts.append(args)
+            if len(attempts) == 1:
+                raise billing.StockConflict('sold concurrently')
+            return apply_batch(*args)
+
+        with mock.patch.object(billing, '_apply_sales_batch', side_effect=conflict_once):
+            response = self.client.post('/api/billing/batch', json={'sales': [self._sale((product, 2))]})
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(response.json['recorded'], 1)
+        self.assertEqual(_stock(product['id']), 3)
+
+    def test_gives_up_after_repeated_conflicts(self):
+        product = create_product(self.client, stock=5)
+        with mock.patch.object(billing, '_apply_sales_batch', side_effect=billing.StockConflict('sold concurrently')):
+            response = self.client.post('/api/billing/batch', json={'sales': [self._sale((product, 2))]})
+
+        self.assertEqual(response.status_code, 409, response.data)
+        self.assertEqual(_stock(product['id']), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,15 @@
-from functools import wraps
-from flask import session, redirect, url_for, jsonify
+from functools import wraps, lru_cache
+from flask import session, redirect, url_for, jsonify, current_app, has_app_context
+import base64
 import hashlib
+import json
+from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import Float
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from extensions import db
 
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
@@ -13,10 +21,28 @@ from io import BytesIO
 # We will upgrade to PBKDF2 (Werkzeug default) for new system
 # but if we needed strict compat with old SHA256 hashes we could keep it.
 # Given it's a "production upgrade", we should use secure hashing.
+# The method/cost comes from Config.PASSWORD_HASH_METHOD; hashes made with
+# anything else (including legacy SHA256) are upgraded on the next login.
+
+DEFAULT_PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+
+def _password_hash_method():
+    if has_app_context():
+        return current_app.config.get('PASSWORD_HASH_METHOD', DEFAULT_PASSWORD_HASH_METHOD)
+    return DEFAULT_PASSWORD_HASH_METHOD
+
+@lru_cache(maxsize=8)
+def _hash_prefix(method):
+    """Fully expanded method prefix Werkzeug writes for a method spec (e.g. 'scrypt' -> 'scrypt:32768:8:1')"""
+    return generate_password_hash('', method=method).split('$', 1)[0]
 
 def hash_password(password):
-    """Hash password using Werkzeug (PBKDF2)"""
-    return generate_password_hash(password)
+    """Hash password using Werkzeug with the configured method and cost"""
+    return generate_password_hash(password, method=_password_hash_method())
+
+def password_needs_rehash(stored_password):
+    """Whether a stored hash uses an outdated algorithm or cost"""
+    return stored_password.split('$', 1)[0] != _hash_prefix(_password_hash_method())
 
 def verify_password(stored_password, provided_password):
     """Verify password"""
@@ -102,6 +128,64 @@ def cashier_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def dialect_insert(table):
+    """INSERT construct with ON CONFLICT (upsert) support for the active backend"""
+    backend = db.engine.dialect.name
+    if backend == 'postgresql':
+        return postgresql.insert(table)
+    if backend == 'sqlite':
+        return sqlite.insert(table)
+    raise NotImplementedError(f'Upserts are not supported on {backend}')
+
+class sql_floor(FunctionElement):
+    """SQL floor(), also on SQLite builds compiled without the math functions"""
+    name = 'floor'
+    type = Float()
+    inherit_cache = True
+
+@compiles(sql_floor)
+def _compile_floor(element, compiler, **kw):
+    return f'floor({compiler.process(element.clauses, **kw)})'
+
+@compiles(sql_floor, 'sqlite')
+def _compile_floor_sqlite(element, compiler, **kw):
+    value = f'({compiler.process(element.clauses, **kw)})'
+    # CAST truncates toward zero: step down once more for negative fractions
+    return f'(CAST({value} AS INTEGER) - ({value} < CAST({value} AS INTEGER)))'
+
+def encode_cursor(*values):
+    """Encode keyset pagination values into an opaque URL-safe token"""
+    raw = json.dumps(values, separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token):
+    """Decode a token from encode_cursor(); raises ValueError if it is malformed"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    return values
+
+def parse_date_param(value, end=False):
+    """Parse a YYYY-MM-DD or ISO datetime query parameter.
+
+    With end=True a bare date is treated as inclusive, i.e. the returned
+    bound is midnight of the following day (use it with `<`).
+    Returns None for empty values; raises ValueError for bad input.
+    """
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+# Bump whenever the invoice layout changes: cached PDFs are keyed on it
+INVOICE_RENDERER_VERSION = 1
+
 def generate_invoice_pdf(record, items):
     """Generate invoice PDF using ReportLab"""
     buffer = BytesIO()
@@ -1,28 +1,59 @@
 import requests
 import time
 import subprocess
+import signal
 import sys
 import os
 
 BASE_URL = "http://localhost:8000"
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
 
-def start_server():
+def wait_for_server(process, base_url=BASE_URL, timeout=30):
+    """Poll the login page until the server answers (instead of a fixed sleep)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited during startup (code {process.returncode})")
+        try:
+            requests.get(f"{base_url}/login", timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server did not answer within {timeout}s")
+
+def start_server(command=None, env=None, base_url=BASE_URL, log=None, timeout=30):
     print("Starting server...")
     # Run in a separate process
     # Set FLASK_ENV to development to ensure SQLite is used (Config default logic)
-    env = os.environ.copy()
-    env["FLASK_ENV"] = "development"
-    env["DATABASE_URL"] = "" # Force SQLite default
-    env["ADMIN_USERNAME"] = "owner"
-    env["ADMIN_PASSWORD"] = "owner123"
+    server_env = os.environ.copy()
+    server_env["FLASK_ENV"] = "development"
+    server_env["DATABASE_URL"] = "" # Force SQLite default
+    server_env["ADMIN_USERNAME"] = "owner"
+    server_env["ADMIN_PASSWORD"] = "owner123"
+    server_env.update(env or {})
     
-    process = subprocess.Popen([sys.executable, "app.py"], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    time.sleep(5) # Wait for startup
+    # Own process group, so stop_server() also stops the dev reloader's child;
+    # output goes to a file (or nowhere) so a full pipe can never block the server
+    process = subprocess.Popen(command or [sys.executable, "app.py"], cwd=APP_DIR, env=server_env,
+                               stdout=log or subprocess.DEVNULL, stderr=subprocess.STDOUT,
+                               start_new_session=True)
+    try:
+        wait_for_server(process, base_url, timeout)
+    except Exception:
+        stop_server(process)
+        raise
     return process
 
 def stop_server(process):
     print("Stopping server...")
-    process.terminate()
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
 
 def test_login(session):
     print("Testing Login...")